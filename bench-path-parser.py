@@ -0,0 +1,62 @@
+import sys
+import argparse
+from glob import glob
+from time import time
+from random import choice, randint
+from typing import List
+from fracgeometry import VPath, FractionList
+from dalmatianmedia import DalmatianMedia
+
+parser = argparse.ArgumentParser(description = 'Compare the dalmatian path parsers')
+parser.add_argument("-i", "--indirectory", help="Directory containing Dalmatian Mask Tape media files to take the brushes from", default = "")
+parser.add_argument("-n", "--count", help="Number of synthetic brushes when no directory is given", default = "1000")
+parser.add_argument("-r", "--repeat", help="Number of times each brush is parsed", default = "10")
+args = parser.parse_args()
+
+fractions = FractionList.from_string("1/2 1/3 1/4 1/5 1/6 1/7 1/8 1/9 1/10 2/3 3/4 2/5 3/5 4/5 5/6")
+
+def create_synthetic_brush()->str:
+    segments = ["M {}".format(fractions.signed_sample())]
+    for _ in range(randint(5, 30)):
+        action = choice("LTCSQ")
+        count = {"L": 1, "T": 1, "C": 3, "S": 2, "Q": 2}[action]
+        segments.append("{} {}".format(action, " ".join([fractions.signed_sample() for _ in range(count)])))
+    return "[ {} ]".format(",".join(segments))
+
+def load_brushes()->List[str]:
+    if args.indirectory == "":
+        return [create_synthetic_brush() for _ in range(int(args.count))]
+    brushes = []
+    for filename in glob("{}/*.dlmt".format(args.indirectory)):
+        with open(filename, 'r') as dlmtfile:
+            media = DalmatianMedia.from_file(dlmtfile)
+            brushes += [brush.vpath.to_dalmatian_string() for brush in media.get_sorted_brushes()]
+    return brushes
+
+def timed(name: str, parse, dstrs: List[str])->float:
+    started = time()
+    for _ in range(int(args.repeat)):
+        parse(dstrs)
+    elapsed = time() - started
+    print("{:<24} {:.3f} seconds".format(name, elapsed))
+    return elapsed
+
+brushes = load_brushes()
+if len(brushes) == 0:
+    print("No brushes found")
+    sys.exit(1)
+
+splitted = [VPath.from_dalmatian_string_by_split(dstr) for dstr in brushes]
+tokenized = [VPath.from_dalmatian_string(dstr) for dstr in brushes]
+assert splitted == tokenized, "The parsers disagree"
+
+print("Parsing {} brushes ({} distinct) {} times".format(len(brushes), len(set(brushes)), args.repeat))
+by_split = timed("split (previous)", lambda dstrs: [VPath.from_dalmatian_string_by_split(dstr) for dstr in dstrs], brushes)
+by_token = timed("tokenizer", lambda dstrs: [VPath.from_dalmatian_string(dstr) for dstr in dstrs], brushes)
+by_bulk = timed("tokenizer bulk", VPath.from_dalmatian_string_list, brushes)
+print("Speedup tokenizer x{:.2f}, bulk x{:.2f}".format(by_split / by_token, by_split / by_bulk))
+# the bulk parser only tokenizes each distinct string once, so it only helps with repeated brushes
+repeated = brushes[:max(1, len(brushes) // 10)] * 10
+by_token_repeated = timed("tokenizer repeated", lambda dstrs: [VPath.from_dalmatian_string(dstr) for dstr in dstrs], repeated)
+by_bulk_repeated = timed("tokenizer bulk repeated", VPath.from_dalmatian_string_list, repeated)
+print("Bulk gain from deduplication only: x{:.2f} on distinct brushes, x{:.2f} with each brush repeated 10 times".format(by_token / by_bulk, by_token_repeated / by_bulk_repeated))
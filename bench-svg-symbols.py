@@ -0,0 +1,75 @@
+import io
+import sys
+import argparse
+import subprocess
+from glob import glob
+from time import time
+from tempfile import NamedTemporaryFile
+from random import choice, randint
+from fractions import Fraction
+from typing import List
+from fracgeometry import V2d
+from dalmatianmedia import DalmatianMedia, DlmtHeaders, DlmtView, DlmtBrushstroke, SvgSymbolMode
+
+parser = argparse.ArgumentParser(description = 'Compare the size and rendering time of svg paths against svg symbols')
+parser.add_argument("-i", "--indirectory", help="Directory containing Dalmatian Mask Tape media files", default = "")
+parser.add_argument("-n", "--count", help="Number of brushstrokes of the synthetic media when no directory is given", default = "2000")
+parser.add_argument("-W", "--width", help="The width of generated bitmap in pixels.", default = "1000")
+parser.add_argument("--inkscape", help="Also time the conversion to png with inkscape", action = "store_true")
+args = parser.parse_args()
+
+default_view = DlmtView.from_string("view i:1 lang en xy 0 0 width 1 height 1 flags o tags all but [  ] -> everything")
+modes = ["none", "brush", "transform"]
+
+def create_synthetic_media()->DalmatianMedia:
+    media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/50")))
+    media.add_view(default_view)
+    media.add_tag_description_string("tag i:1 lang en same-as [] -> default")
+    media.add_brush_string("brush i:1 ext-id brushes:a path [ M -1/3 1/3,L 0 0,L 1/3 1/3,L 1/3 -1/3,L -1/3 -1/3 ]")
+    media.add_brush_string("brush i:2 ext-id brushes:b path [ M -1/3 1/3,C 1/5 1/6 1/7 1/8 1/9 1/10,S 1/5 1/6 1/7 1/8,Q 1/3 1/4 1/5 1/6,Z ]")
+    for _ in range(int(args.count)):
+        xy = V2d(Fraction(randint(50, 950), 1000), Fraction(randint(50, 950), 1000))
+        media.add_brushstroke(DlmtBrushstroke(choice(["i:1", "i:2"]), xy, Fraction(randint(1, 4), 2), Fraction(randint(0, 7), 8), ["i:1"]))
+    return media
+
+def load_media()->List[DalmatianMedia]:
+    if args.indirectory == "":
+        return [create_synthetic_media()]
+    medias = []
+    for filename in glob("{}/*.dlmt".format(args.indirectory)):
+        with open(filename, 'r') as dlmtfile:
+            medias.append(DalmatianMedia.from_file(dlmtfile))
+    return medias
+
+def render(media: DalmatianMedia, mode: str)->bytes:
+    renderConfig = media.create_page_pixel_coordinate_with_view(int(args.width), default_view).set_symbol_mode(SvgSymbolMode.from_string(mode))
+    content = io.BytesIO()
+    media.to_xml_svg_file(renderConfig, content)
+    return content.getvalue()
+
+def time_inkscape(content: bytes)->float:
+    with NamedTemporaryFile(suffix = ".svg") as svgfile:
+        svgfile.write(content)
+        svgfile.flush()
+        started = time()
+        subprocess.run(["inkscape", "--export-type=png", "--export-filename=-", svgfile.name], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = True)
+        return time() - started
+
+medias = load_media()
+if len(medias) == 0:
+    print("No media found")
+    sys.exit(1)
+
+print("{:<10} {:>12} {:>12} {:>12}".format("mode", "bytes", "svg (s)", "png (s)" if args.inkscape else ""))
+for mode in modes:
+    size = 0
+    elapsed = 0.0
+    raster = 0.0
+    for media in medias:
+        started = time()
+        content = render(media, mode)
+        elapsed += time() - started
+        size += len(content)
+        if args.inkscape:
+            raster += time_inkscape(content)
+    print("{:<10} {:>12} {:>12.3f} {:>12}".format(mode, size, elapsed, "{:.3f}".format(raster) if args.inkscape else ""))
@@ -0,0 +1,43 @@
+import argparse
+from time import time
+from random import choice, seed
+from fracgeometry import FractionList
+from tortuga import TortugaConfig, TortugaCompiledProducer
+
+parser = argparse.ArgumentParser(description = 'Compare the scalar and the vectorized walks of compiled tortuga chains')
+parser.add_argument("-n", "--length", help="Number of actions of the synthetic chains", default = "20000")
+parser.add_argument("-r", "--repeat", help="Number of times each chain is walked", default = "10")
+args = parser.parse_args()
+
+seed(7)
+
+def create_chain(actions: str)->str:
+    return "".join([choice(actions) for _ in range(int(args.length))])
+
+def create_config(chain: str)->TortugaConfig:
+    config = TortugaConfig().set_chain(chain).set_xy_string("1/2 1/2")
+    config.set_angles_string("0 1/7 2/9 1/4 1/3").set_magnitudes_string("1 2 5/3 7")
+    config.set_brush_ids(["i:1", "i:2", "i:3"]).set_tags(["", "i:1"])
+    config.set_magnitude_page_ratio(FractionList.from_string("1/1000").values[0])
+    return config
+
+def timed(walk)->float:
+    started = time()
+    for _ in range(int(args.repeat)):
+        walk()
+    return time() - started
+
+chains = {
+    "branch free": create_chain("PPPPAL><Z-"),
+    "bracketed": create_chain("PPPPAL><Z-[]"),
+    "short runs": create_chain("PPAL>[]"),
+}
+
+print("Walking chains of {} actions {} times".format(args.length, args.repeat))
+print("{:<12} {:>8} {:>8} {:>14} {:>14}".format("chain", "points", "runs", "scalar (s)", "vectorized (s)"))
+for name, chain in chains.items():
+    producer = TortugaCompiledProducer(create_config(chain))
+    runs = len(producer.program.branch_runs()[0])
+    scalar = timed(lambda: producer.produce_records(False))
+    vectorized = timed(producer.produce_arrays)
+    print("{:<12} {:>8} {:>8} {:>14.3f} {:>14.3f}".format(name, producer.count_points(), runs, scalar, vectorized))
@@ -8,7 +8,7 @@ import json
 import re
 import glob
 from random import sample, choice, randint
-from fracgeometry import V2d, V2dList, VSegment, VPath, FractionList
+from fracgeometry import V2d, V2dArrayList, VSegment, VPath, FractionList
 from breeding import ProductionGame
 from datetime import date
 
@@ -112,7 +112,7 @@ def extractIdWithTags():
     withTags = { tagInfo["id"]: tagInfo["tags"] for tagInfo in  tagInfoLines if len(tagInfo["tags"])>0 }
     return withTags
 
-def messup_stake(stake: V2dList):
+def messup_stake(stake: V2dArrayList):
     if randint(1, 7) is 1:
         return stake
     newstake = stake.clone()
@@ -124,7 +124,7 @@ def messup_stake(stake: V2dList):
     length = len(stake)
     endslice = randint(4, length)
     inc = randint(1, 4)
-    newstake = V2dList(newstake[:endslice:inc])
+    newstake = newstake.select(slice(None, endslice, inc))
     
     if len(newstake)<5:
         return messup_stake(stake)
@@ -245,12 +245,12 @@ class Experimenting:
         return counter
     
     def createSpecimen(self):
-        stake = messup_stake(V2dList.from_dalmatian_string(choice(self.pool["stakes"]), sep=","))
+        stake = messup_stake(V2dArrayList.from_dalmatian_string(choice(self.pool["stakes"]), sep=","))
         spaghetti = randint(1, 2) is 1
         fxWeight = FractionList.from_string(self.pool["fx-weights"]).choice()
-        deltas = V2dList.from_dalmatian_list(self.fractionList.signed_sample_list(len(stake), 2))
+        deltas = V2dArrayList.from_dalmatian_list(self.fractionList.signed_sample_list(len(stake), 2))
         tweaks = self.fractionList.signed_sample_list(len(stake), 5)
-        points = stake + (deltas*fxWeight)
+        points = (stake + deltas*fxWeight).to_v2d_list()
         product = ProductionGame(chainlength = len(points) -1)
         product.set_constants("ZMLCQST").set_vars("IJK")
         product.init_with_random_rules(levels = 2, keyrules = self.pool["rules"])
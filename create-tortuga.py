@@ -9,11 +9,11 @@ from datetime import date
 from time import sleep, time
 from random import sample, choice, randint, shuffle
 from typing import List, Tuple, Dict, Set
-from fracgeometry import V2d, V2dList, VSegment, VPath, FractionList
+from fracgeometry import V2d, V2dList, V2dStats, VSegment, VPath, FractionList, TRIG_TABLE, NumericPolicy, set_numeric_policy
 from breeding import ProductionGame
 from experimentio import ExperimentFS, TypicalDir
-from tortuga import TortugaConfig, TortugaProducer, TortugaRuleMaker
-from dalmatianmedia import DlmtView, DlmtTagDescription, DlmtBrush, DlmtBrushstroke, DlmtCoordinateSystem, DlmtBrushCoordinateSystem, DlmtHeaders, DalmatianMedia, SvgRenderingConfig
+from tortuga import TortugaConfig, TortugaProgram, TortugaCompiledProducer, TortugaStats, TortugaRuleMaker, abort_when_outside_above
+from dalmatianmedia import DlmtView, DlmtTagDescription, DlmtBrush, DlmtBrushstroke, DlmtCoordinateSystem, DlmtBrushCoordinateSystem, DlmtHeaders, DalmatianMedia, SvgRenderingConfig, SvgFragmentCache
 
 today = date.today()
 started = time()
@@ -48,6 +48,7 @@ class XpInitConf:
         self.max_chain_length: int = content["max-chain-length"]
         self.specimen_attempts: int = content["specimen-attempts"]
         self.min_median_range: V2d = V2d.from_string(content["min-median-range"])
+        self.numeric_policy: NumericPolicy = NumericPolicy.from_string(content.get("numeric-policy", "exact"))
 
 class XpPoolConf:
     def __init__(self, content):
@@ -93,7 +94,14 @@ class Experimenting:
             self.content = json.load(jsonfile)
             self.pool = XpPoolConf(self.content["mutations"]["pool"])
             self.init = XpInitConf(self.content["mutations"]["init"])
-            return self.content   
+            self.preload_trig_table()
+            set_numeric_policy(self.init.numeric_policy)
+            return self.content
+
+    def preload_trig_table(self):
+        offset = self.init.brushstoke_angle_offset
+        angles = self.pool.angles.to_list()
+        TRIG_TABLE.preload(angles + [-a for a in angles] + [a + offset for a in angles] + [offset - a for a in angles])
 
     def delete_specimen_svg(self):
         oldSvgFiles = glob.glob('{}/eval-*.svg'.format(xpfs.get_directory(TypicalDir.EVALUATION)))
@@ -114,6 +122,12 @@ class Experimenting:
         self.content["general"]["counter"] = counter
         return counter
     
+    def get_brushstroke_margin(self, stencil: DalmatianMedia, tortugaconfig: TortugaConfig)->float:
+        # a brushstroke whose position is farther than this from the page cannot be inside it
+        radius = max([stencil.get_brush_radius(brushid) for brushid in stencil.brushes_dict])
+        scale = max([abs(magnitude) for magnitude in tortugaconfig.magnitudes]) * tortugaconfig.scale_magnitude_ratio
+        return radius * float(self.init.brush_page_ratio * scale)
+
     def create_specimen(self):
         # Create L-System
         product = ProductionGame(chainlength = randint(100, self.init.max_chain_length))
@@ -136,14 +150,18 @@ class Experimenting:
         tortugaconfig.set_magnitudes_string(magnitudes)
         tortugaconfig.set_brush_ids(self.init.brushids)
         tortugaconfig.set_chain(product.chain)
-        brushstokes = TortugaProducer(tortugaconfig).produce()
-        bstats = V2dList([bs.xy for bs in brushstokes])
         # Create stencil aka DalmatianMedia
         stencil = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(self.init.brush_page_ratio))
         stencil.add_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags o tags all but [ ] -> everything")
         stencil.add_tag_description_string("tag i:1 lang en same-as [] -> default")
         for brush in self.init.brushes:
             stencil.add_brush_string(brush)
+        producer = TortugaCompiledProducer(tortugaconfig)
+        bstats = TortugaStats(producer.count_points(), self.get_brushstroke_margin(stencil, tortugaconfig))
+        brushstokes = producer.produce(bstats, abort_when_outside_above(Fraction(1, 5)))
+        if producer.aborted:
+            print("F", end="")
+            return None
         stencil.set_brushstrokes(brushstokes)
         allbr = stencil.page_brushstroke_list_for_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags o tags all but [ ] -> everything")
         fitbr = stencil.page_brushstroke_list_for_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags O tags all but [ ] -> everything")
@@ -191,14 +209,18 @@ class Experimenting:
         tortugaconfig.set_magnitudes_string(magnitudes)
         tortugaconfig.set_brush_ids(self.init.brushids)
         tortugaconfig.set_chain(product.chain)
-        brushstokes = TortugaProducer(tortugaconfig).produce()
-        bstats = V2dList([bs.xy for bs in brushstokes])
         # Create stencil aka DalmatianMedia
         stencil = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(self.init.brush_page_ratio))
         stencil.add_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags o tags all but [ ] -> everything")
         stencil.add_tag_description_string("tag i:1 lang en same-as [] -> default")
         for brush in self.init.brushes:
             stencil.add_brush_string(brush)
+        producer = TortugaCompiledProducer(tortugaconfig)
+        bstats = TortugaStats(producer.count_points(), self.get_brushstroke_margin(stencil, tortugaconfig))
+        brushstokes = producer.produce(bstats, abort_when_outside_above(Fraction(1, 5)))
+        if producer.aborted:
+            print("F", end="")
+            return None
         stencil.set_brushstrokes(brushstokes)
         allbr = stencil.page_brushstroke_list_for_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags o tags all but [ ] -> everything")
         fitbr = stencil.page_brushstroke_list_for_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags O tags all but [ ] -> everything")
@@ -241,10 +263,11 @@ class Experimenting:
             break
         return specimen 
 
-    def mutation_specimen(self, specimen):
+    def mutation_specimen(self, specimen, product: ProductionGame = None, program: TortugaProgram = None):
         # Create L-System
-        product = ProductionGame.from_obj(specimen["product"])
-        product.produce()
+        if product is None:
+            product = ProductionGame.from_obj(specimen["product"])
+            product.produce()
         product_obj = product.to_obj()
         
         # Convert chain to brushstokes
@@ -258,14 +281,18 @@ class Experimenting:
         tortugaconfig.set_magnitudes_string(magnitudes)
         tortugaconfig.set_brush_ids(self.init.brushids)
         tortugaconfig.set_chain(product.chain)
-        brushstokes = TortugaProducer(tortugaconfig).produce()
-        bstats = V2dList([bs.xy for bs in brushstokes])
         # Create stencil aka DalmatianMedia
         stencil = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(self.init.brush_page_ratio))
         stencil.add_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags o tags all but [ ] -> everything")
         stencil.add_tag_description_string("tag i:1 lang en same-as [] -> default")
         for brush in self.init.brushes:
             stencil.add_brush_string(brush)
+        producer = TortugaCompiledProducer(tortugaconfig, program)
+        bstats = TortugaStats(producer.count_points(), self.get_brushstroke_margin(stencil, tortugaconfig))
+        brushstokes = producer.produce(bstats, abort_when_outside_above(Fraction(1, 5)))
+        if producer.aborted:
+            print("F", end="")
+            return None
         stencil.set_brushstrokes(brushstokes)
         allbr = stencil.page_brushstroke_list_for_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags o tags all but [ ] -> everything")
         fitbr = stencil.page_brushstroke_list_for_view_string("view i:1 lang en xy 0 0 width 1 height 1 flags O tags all but [ ] -> everything")
@@ -328,9 +355,13 @@ class Experimenting:
         return media
 
     def create_better_mutant_specimen(self, refspecimen, attempts: int):
-        specimen = self.mutation_specimen(refspecimen)
+        # the attempts only change the angles and magnitudes, so the chain is expanded and compiled once
+        product = ProductionGame.from_obj(refspecimen["product"])
+        product.produce()
+        program = TortugaProgram.from_chain(product.chain)
+        specimen = self.mutation_specimen(refspecimen, product, program)
         for _ in range(attempts):
-            specimen = self.mutation_specimen(refspecimen)
+            specimen = self.mutation_specimen(refspecimen, product, program)
             print(".", end="", flush=True)
             sleep(0.4) # otherwise overheating, in addition let's keep it under 2000 mutations
             if specimen is None:
@@ -461,6 +492,8 @@ class Experimenting:
         started_svg = time()
         self.delete_specimen_svg()
         specimens = self.content['specimens']
+        # specimens bred from the same parents share most brushstrokes, so they share the serialized paths
+        fragments = SvgFragmentCache()
         svg_count = 1
         for specimen in specimens:
             if len(specimen["tags"])>0:
@@ -469,11 +502,12 @@ class Experimenting:
                 if args.brushes and "preserve" in specimen["tags"]:
                     continue
             svg_count = svg_count + 1
-            stencil = DalmatianMedia.from_obj(specimen["stencil"])
+            stencil = DalmatianMedia.from_obj(specimen["stencil"]).set_svg_fragment_cache(fragments)
             filename = "{}/eval-{}.svg".format(xpfs.get_directory(TypicalDir.EVALUATION), specimen["id"])
-            stencil.to_xml_svg_file(stencil.create_page_pixel_coordinate("i:1", 100), filename)
+            stencil.to_xml_svg_file(stencil.create_page_pixel_coordinate("i:1", 100).set_float_mode(True), filename)
             print("New: {} : {}".format(specimen["id"], specimen["summary"]))
         finished_svg = time()
+        print("Reused {:.0%} of the svg paths".format(fragments.hit_ratio()))
         print("Saving to svg took {} seconds thus {} second per specimen".format(finished_svg-started_svg, (finished_svg-started_svg)/svg_count))
     
     def save_everything(self):
@@ -487,4 +521,5 @@ experimenting.save_everything()
 experimenting.publish()
 os.system('say Ready')
 finished = time()
-print("Took {} seconds thus {} second per specimen".format(finished-started, (finished-started)/experimenting.init.population))
\ No newline at end of file
+print("Took {} seconds thus {} second per specimen".format(finished-started, (finished-started)/experimenting.init.population))
+print("Trig table hit ratio {:.2%} with {}".format(TRIG_TABLE.hit_ratio(), TRIG_TABLE.get_stats()))
\ No newline at end of file
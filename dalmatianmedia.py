@@ -2,13 +2,18 @@ import os
 import sys
 import argparse
 import re
+import json
+import mmap
 from fractions import Fraction
-from typing import List, Tuple, Dict, Set
+from typing import List, Tuple, Dict, Set, Union
+from collections import OrderedDict
 from enum import Enum, auto
+from math import sqrt, floor
 import xml.etree.ElementTree as ET
 from xml.etree.ElementTree import ElementTree
 
-from fracgeometry import V2d, V2dList, VSegment, VPath, FractionList
+from numpy import array, frombuffer, float64, int64, int32, uint8, uint64, stack, full
+from fracgeometry import V2d, V2dList, V2dRect, SegmentShape, VSegment, VPath, VPathArray, FractionList, Affine2d, TRIG_TABLE, FLOAT_RECT_TOLERANCE, float_affine_from_transform, float_affine_then
 
 if not (sys.version_info.major == 3 and sys.version_info.minor >= 5):
     print("This script requires Python 3.5 or higher!")
@@ -147,6 +152,16 @@ class DlmtBrush:
         
         return cls(id = brushId, ext_id = extId, vpath = VPath.from_dalmatian_string(other))
 
+    @classmethod
+    def from_string_list(cls, lines: List[str]):
+        parts = [line.split(" ", 5 ) for line in lines]
+        for line, (cmd, _, extIdKey, _, pathKey, _) in zip(lines, parts):
+            assert cmd == "brush", line
+            assert extIdKey == "ext-id", line
+            assert pathKey == "path", line
+        vpaths = VPath.from_dalmatian_string_list([part[5] for part in parts])
+        return [cls(id = part[1], ext_id = part[3], vpath = vpath) for part, vpath in zip(parts, vpaths)]
+
     def to_string(self):
         return "brush {} ext-id {} path {}".format(self.id, self.ext_id, self.vpath.to_dalmatian_string())
     
@@ -478,6 +493,34 @@ class DlmtHeaders:
 
 
 
+class SvgSymbolMode(Enum):
+    NONE = auto()
+    BRUSH = auto()
+    TRANSFORM = auto()
+    NOT_SUPPORTED = auto()
+
+    @classmethod
+    def from_string(cls, value: str):
+        if value == "none":
+            return SvgSymbolMode.NONE
+        elif value == "brush":
+            return SvgSymbolMode.BRUSH
+        elif value == "transform":
+            return SvgSymbolMode.TRANSFORM
+        else:
+            return SvgSymbolMode.NOT_SUPPORTED
+
+    @classmethod
+    def to_string(cls, value):
+        if value == SvgSymbolMode.NONE:
+            return "none"
+        elif value == SvgSymbolMode.BRUSH:
+            return "brush"
+        elif value == SvgSymbolMode.TRANSFORM:
+            return "transform"
+        else:
+            return "E"
+
 class SvgRenderingConfig:
     
     def __init__(self, headers: DlmtHeaders, view: DlmtView, view_pixel_width: int):
@@ -487,6 +530,26 @@ class SvgRenderingConfig:
         self.zoomk = Fraction(1) / view.width # normalise view width to 1
         self.view_pixel_height = self.zoomk * view.height * self.view_pixel_width
         self.brush_width = self.zoomk * headers.brush_page_ratio * self.view_pixel_width
+        self.float_mode = False
+        self.symbol_mode = SvgSymbolMode.NONE
+
+    def set_float_mode(self, value: bool):
+        self.float_mode = value
+        return self
+
+    def set_symbol_mode(self, value: SvgSymbolMode):
+        if value == SvgSymbolMode.NOT_SUPPORTED:
+            raise Exception("Svg symbol mode not supported")
+        self.symbol_mode = value
+        return self
+
+    def get_page_pixel_ratio(self)->Fraction:
+        return self.zoomk * self.view_pixel_width
+
+    def to_svg_translate(self, xy: V2d)->Tuple[float, float]:
+        # position of a page point in the svg, whose y axis points down
+        ratio = self.get_page_pixel_ratio()
+        return (float(ratio * (xy.x - self.view.xy.x)), float(self.view_pixel_height - ratio * (xy.y - self.view.xy.y)))
 
     def to_page_view_box(self):
         return "0 0 {}".format(V2d(self.view_pixel_width, self.view_pixel_height).to_float_string())
@@ -518,17 +581,284 @@ class PageBrushstroke:
         element = ET.Element('path', attrib = { "d": self.vpath.to_svg_string(float(renderConfig.view_pixel_width), float(renderConfig.view_pixel_height) ) })
         return element
     
+    def transform(self, affine: Affine2d):
+        return PageBrushstroke(self.vpath.transform(affine), self.tags)
+
+    def get_bounding_box(self, control_points = False)->V2dRect:
+        return self.vpath.get_bounding_box(control_points)
+
+    def is_inside_rect(self, rect: V2dRect)->bool:
+        return self.vpath.is_inside_rect(rect)
+
+    def intersects_rect(self, rect: V2dRect, control_points = False)->bool:
+        return self.vpath.intersects_rect(rect, control_points)
+
     def zoom_to(self, xy: V2d, width: Fraction):
-        return PageBrushstroke(self.vpath.translate(-xy).scale(Fraction(1) / width), self.tags)
+        return self.transform(Affine2d.from_zoom(xy, width))
+
+# The float64 counterpart of PageBrushstroke used by the float rendering,
+# with float bounding boxes
+class FloatPageBrushstroke:
+    def __init__(self, vpath: VPathArray, tags: Set[str]):
+        self.vpath = vpath
+        self.tags = tags
+
+    def to_string(self):
+        return "fpbs path {} tags {}".format(self.vpath.to_float_string(), list(self.tags))
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return self.to_string()
+
+    def __eq__(self, other):
+        return isinstance(other, FloatPageBrushstroke) and self.vpath == other.vpath and self.tags == other.tags
+
+    def to_xml_svg(self, renderConfig: SvgRenderingConfig):
+        element = ET.Element('path', attrib = { "d": self.vpath.to_svg_string(float(renderConfig.view_pixel_width), float(renderConfig.view_pixel_height) ) })
+        return element
+
+    def transform(self, affine: Affine2d):
+        return FloatPageBrushstroke(self.vpath.transform(affine.to_float_tuple()), self.tags)
+
+    def get_float_bounding_box(self, control_points = False)->Tuple[float, float, float, float]:
+        return self.vpath.get_float_bounding_box(control_points)
+
+    def is_inside_rect(self, rect: V2dRect)->bool:
+        return self.vpath.is_inside_rect(rect)
+
+    def intersects_rect(self, rect: V2dRect, control_points = False)->bool:
+        return self.vpath.intersects_rect(rect, control_points)
+
+    def zoom_to(self, xy: V2d, width: Fraction):
+        return self.transform(Affine2d.from_zoom(xy, width))
+
+# Bounded LRU cache of the rotated and scaled brush geometry, keyed by
+# (brush id, angle, scale, brush page ratio)
+class PageGeometryCache:
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        found = self.entries.get(key)
+        if found is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return found
+        self.misses += 1
+        found = compute()
+        if self.maxsize > 0:
+            self.entries[key] = found
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+        return found
+
+    def set_maxsize(self, maxsize: int):
+        self.maxsize = maxsize
+        while len(self.entries) > maxsize:
+            self.entries.popitem(last = False)
+        return self
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        return self
+
+    def clear(self):
+        self.entries = OrderedDict()
+        return self
+
+    def get_stats(self)->Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.entries),
+            "maxsize": self.maxsize
+        }
+
+    def hit_ratio(self)->float:
+        total = self.hits + self.misses
+        return 1.0 if total == 0 else self.hits / total
+
+# Serialized svg paths keyed by the rendering, the brush geometry and the
+# brushstroke transform. A cache shared between media only serializes the
+# brushstrokes it has not met before, whatever media they come from.
+class SvgFragmentCache(PageGeometryCache):
+    def __init__(self, maxsize: int = 1 << 16):
+        super().__init__(maxsize)
+
+    def lookup(self, key):
+        found = self.entries.get(key)
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return found
+
+    def put(self, key, value):
+        if self.maxsize > 0:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+        return self
+
+# Tag ids interned into bit positions: the declared tags first, then any
+# other tag in the order it is met
+class TagBitmaskIndex:
+    def __init__(self, tag_ids: List[str] = []):
+        self.bits = {}
+        for tagid in tag_ids:
+            self.intern(tagid)
+
+    def __len__(self):
+        return len(self.bits)
+
+    def intern(self, tagid: str)->int:
+        bit = self.bits.get(tagid)
+        if bit is None:
+            bit = 1 << len(self.bits)
+            self.bits[tagid] = bit
+        return bit
+
+    def get_tag_ids(self)->List[str]:
+        return list(self.bits)
+
+    def to_mask(self, tags: List[str])->int:
+        mask = 0
+        for tagid in tags:
+            mask |= self.intern(tagid)
+        return mask
+
+    def get_view_mask(self, view: DlmtView)->int:
+        # a tag nobody uses cannot match, so it does not need a bit
+        mask = 0
+        for tagid in view.tags:
+            mask |= self.bits.get(tagid, 0)
+        return mask
+
+    def accept_mask(self, view: DlmtView, view_mask: int, mask: int)->bool:
+        if view.everything:
+            return mask & view_mask == 0
+        else:
+            return mask & view_mask != 0
+
+# Uniform grid over the page bounding boxes of the brushstrokes; a query
+# returns the indices of the brushstrokes whose box meets the rectangle
+class BrushstrokeGridIndex:
+    def __init__(self, boxes: List[Tuple[float, float, float, float]], cell_size: float):
+        self.boxes = boxes
+        self.cell_size = cell_size
+        self.cells = {}
+        # a None box has no extent to index, so it is a candidate for every query
+        self.unbounded = [i for i, box in enumerate(boxes) if box is None]
+        for i, box in enumerate(boxes):
+            if box is None:
+                continue
+            for cell in self._cells_of(box):
+                self.cells.setdefault(cell, []).append(i)
+
+    @classmethod
+    def from_boxes(cls, boxes: List[Tuple[float, float, float, float]]):
+        bounded = [box for box in boxes if box is not None]
+        if len(bounded) == 0:
+            return cls(boxes, 1.0)
+        width = max([box[2] for box in bounded]) - min([box[0] for box in bounded])
+        height = max([box[3] for box in bounded]) - min([box[1] for box in bounded])
+        mean_size = sum([max(box[2] - box[0], box[3] - box[1]) for box in bounded]) / len(bounded)
+        cell_size = max(max(width, height) / sqrt(len(bounded)), mean_size, 1e-9)
+        return cls(boxes, cell_size)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cells_of(self, box: Tuple[float, float, float, float]):
+        xmin, ymin, xmax, ymax = box
+        for cx in range(floor(xmin / self.cell_size), floor(xmax / self.cell_size) + 1):
+            for cy in range(floor(ymin / self.cell_size), floor(ymax / self.cell_size) + 1):
+                yield (cx, cy)
+
+    def query(self, box: Tuple[float, float, float, float])->List[int]:
+        xmin, ymin, xmax, ymax = box
+        if len(self.boxes) == 0 or xmax < xmin or ymax < ymin:
+            return []
+        if len(self.cells) == 0:
+            return list(self.unbounded)
+        # clamp the query to the occupied cells so that a huge rectangle stays cheap
+        cxs = [cell[0] for cell in self.cells]
+        cys = [cell[1] for cell in self.cells]
+        left, right = max(floor(xmin / self.cell_size), min(cxs)), min(floor(xmax / self.cell_size), max(cxs))
+        bottom, top = max(floor(ymin / self.cell_size), min(cys)), min(floor(ymax / self.cell_size), max(cys))
+        found = set(self.unbounded)
+        for cx in range(left, right + 1):
+            for cy in range(bottom, top + 1):
+                for i in self.cells.get((cx, cy), []):
+                    bxmin, bymin, bxmax, bymax = self.boxes[i]
+                    if bxmin <= xmax and bxmax >= xmin and bymin <= ymax and bymax >= ymin:
+                        found.add(i)
+        return sorted(found)
+
+# All the brushstrokes of one brush in page space: points is (N, 2, M) for
+# N brushstrokes of a brush with M control points
+class PageBrushstrokeBatch:
+    def __init__(self, brushid: str, indices, points, brush: VPathArray, tags: List[Set[str]]):
+        self.brushid = brushid
+        self.indices = indices
+        self.points = points
+        self.brush = brush
+        self.tags = tags
+
+    def __len__(self):
+        return len(self.indices)
+
+    def get_vpath_array(self, i: int)->VPathArray:
+        return VPathArray(self.points[i], self.brush.template, self.brush.core_index)
+
+    def get_float_page_brushstroke(self, i: int)->FloatPageBrushstroke:
+        return FloatPageBrushstroke(self.get_vpath_array(i), self.tags[i])
+
+    def transform(self, matrix: Tuple[float, float, float, float, float, float]):
+        a, b, c, d, e, f = matrix
+        x, y = self.points[:, 0], self.points[:, 1]
+        return PageBrushstrokeBatch(self.brushid, self.indices, stack([a*x + b*y + e, c*x + d*y + f], axis=1), self.brush, self.tags)
+
+    def select(self, keep):
+        return PageBrushstrokeBatch(self.brushid, self.indices[keep], self.points[keep], self.brush, [tags for tags, kept in zip(self.tags, keep) if kept])
+
+    def get_float_bounding_boxes(self):
+        core = self.points[:, :, self.brush.core_index]
+        return stack([core[:, 0].min(axis=1), core[:, 1].min(axis=1), core[:, 0].max(axis=1), core[:, 1].max(axis=1)], axis=1)
+
+    def inside_rect_mask(self, rect: V2dRect):
+        if len(self.brush.core_index) == 0:
+            return full(len(self), len(self.brush.template) > 0)
+        boxes = self.get_float_bounding_boxes()
+        left, bottom = float(rect.xy.x) - FLOAT_RECT_TOLERANCE, float(rect.xy.y) - FLOAT_RECT_TOLERANCE
+        right, top = float(rect.xy.x + rect.width) + FLOAT_RECT_TOLERANCE, float(rect.xy.y + rect.height) + FLOAT_RECT_TOLERANCE
+        return (boxes[:, 0] >= left) & (boxes[:, 1] >= bottom) & (boxes[:, 2] <= right) & (boxes[:, 3] <= top)
 
 class DalmatianMedia:
-    
+
     def __init__(self, headers: DlmtHeaders):
         self.headers = headers
         self.views_dict = {}
         self.tag_descriptions = []
         self.brushstrokes = []
         self.brushes_dict = {}
+        self.brush_arrays = {}
+        self.page_geometry = PageGeometryCache()
+        self.spatial_index = None
+        self.spatial_index_ratio = None
+        self.tag_index = None
+        self.stroke_tag_masks = []
+        self.view_indices = {}
+        self.brush_fingerprints = {}
+        self.svg_fragments = None
         
     def __repr__(self):
         return "id: {}, views:{}, tags:{}, brushes:{}, brushstrokes:{}".format(self.headers.id_urn, len(self.views_dict), len(self.tag_descriptions), len(self.brushes_dict), len(self.brushstrokes))
@@ -551,10 +881,12 @@ class DalmatianMedia:
 
     def set_tag_descriptions(self, tag_descriptions: List[DlmtTagDescription]):
         self.tag_descriptions = tag_descriptions
+        self.tag_index = None
         return self
 
     def add_tag_description(self, tag_description: DlmtTagDescription):
         self.tag_descriptions.append(tag_description)
+        self.tag_index = None
         return self
 
     def add_tag_description_string(self, tag_description: str):
@@ -562,10 +894,18 @@ class DalmatianMedia:
 
     def set_brushes(self, brushes: List[DlmtBrush]):
         self.brushes_dict = {brush.id:brush for brush in brushes }
+        self.brush_arrays = {}
+        self.page_geometry.clear()
+        self.spatial_index = None
+        self.brush_fingerprints = {}
         return self
 
     def add_brush(self, brush: DlmtBrush):
         self.brushes_dict[brush.id] = brush
+        self.brush_arrays.pop(brush.id, None)
+        self.page_geometry.clear()
+        self.spatial_index = None
+        self.brush_fingerprints = {}
         return self
 
     def add_brush_string(self, brush: str):
@@ -573,10 +913,14 @@ class DalmatianMedia:
 
     def set_brushstrokes(self, brushstrokes: List[DlmtBrushstroke]):
         self.brushstrokes = brushstrokes
+        self.spatial_index = None
+        self.tag_index = None
         return self
 
     def add_brushstroke(self, brushstroke: DlmtBrushstroke):
         self.brushstrokes.append(brushstroke)
+        self.spatial_index = None
+        self.tag_index = None
         return self
 
     def add_brushstroke_string(self, brushstroke: str):
@@ -628,7 +972,7 @@ class DalmatianMedia:
         headers = DlmtHeaders.from_string_list(mediaobj["headers"])
         views = [DlmtView.from_string(view) for view in mediaobj["views"]]
         tag_descriptions = [DlmtTagDescription.from_string(tagdesc) for tagdesc in mediaobj["tag-descriptions"]]
-        brushes = [DlmtBrush.from_string(brush) for brush in mediaobj["brushes"]]
+        brushes = DlmtBrush.from_string_list(mediaobj["brushes"])
         brushstrokes = [DlmtBrushstroke.from_string(brushstroke) for brushstroke in mediaobj["brushstrokes"]]
         return cls(headers).set_views(views).set_tag_descriptions(tag_descriptions).set_brushes(brushes).set_brushstrokes(brushstrokes)
 
@@ -648,10 +992,25 @@ class DalmatianMedia:
         dlmtheaders = DlmtHeaders.from_string_list(strip_unknown(":", headers[1:]))
         dlmtviews = [DlmtView.from_string(view) for view in strip_unknown("view ", views[1:])]
         dlmttag_descriptions = [DlmtTagDescription.from_string(tagdesc) for tagdesc in strip_unknown("tag ", tagDescriptions[1:])]
-        dlmtbrushes = [DlmtBrush.from_string(brush) for brush in strip_unknown("brush ", brushes[1:])]
+        dlmtbrushes = DlmtBrush.from_string_list(strip_unknown("brush ", brushes[1:]))
         dlmtbrushstrokes = [DlmtBrushstroke.from_string(brushstroke) for brushstroke in strip_unknown("brushstroke ", brushstrokes[1:])]
         return cls(dlmtheaders).set_views(dlmtviews).set_tag_descriptions(dlmttag_descriptions).set_brushes(dlmtbrushes).set_brushstrokes(dlmtbrushstrokes)
 
+    @classmethod
+    def from_file(cls, file_or_mmap):
+        return DlmtReader.from_file(file_or_mmap).read()
+
+    @classmethod
+    def from_binary_file(cls, filename: str):
+        binary = DlmtBinary.open(filename)
+        try:
+            return binary.to_media()
+        finally:
+            binary.close()
+
+    def to_binary_file(self, file_or_filename):
+        DlmtBinary.from_media(self).write(file_or_filename)
+
     def get_tag_ids(self)->Set[str]:
         return set([tag.id for tag in self.tag_descriptions])
 
@@ -701,20 +1060,265 @@ class DalmatianMedia:
     def create_page_pixel_coordinate_with_view(self, view_pixel_width: int, view: DlmtView)->SvgRenderingConfig:
         return SvgRenderingConfig(self.headers, view, view_pixel_width)
 
+    def get_page_transform(self, brushstroke: DlmtBrushstroke)->Affine2d:
+        return Affine2d.identity().rotate(brushstroke.angle).scale(self.headers.brush_page_ratio * brushstroke.scale).translate(brushstroke.xy)
+
+    def get_rotated_scaled_brush(self, brushstroke: DlmtBrushstroke)->VPath:
+        ratio = self.headers.brush_page_ratio
+        key = (brushstroke.brushid, brushstroke.angle, brushstroke.scale, ratio)
+        return self.page_geometry.get(key, lambda: self.get_brush_by_id(brushstroke.brushid).vpath.transform(Affine2d.identity().rotate(brushstroke.angle).scale(ratio * brushstroke.scale)))
+
+    def set_page_geometry_cache_size(self, maxsize: int):
+        self.page_geometry.set_maxsize(maxsize)
+        return self
+
+    def get_page_geometry_stats(self)->Dict[str, int]:
+        return self.page_geometry.get_stats()
+
+    def set_svg_fragment_cache(self, cache: SvgFragmentCache):
+        self.svg_fragments = cache
+        return self
+
+    def get_brush_fingerprint(self, brushid: str)->str:
+        if brushid not in self.brush_fingerprints:
+            self.brush_fingerprints[brushid] = self.get_brush_by_id(brushid).vpath.to_dalmatian_string()
+        return self.brush_fingerprints[brushid]
+
+    def get_brushstroke_fingerprint(self, brushstroke: DlmtBrushstroke)->Tuple:
+        # the tags are left out: they only decide which brushstrokes are rendered
+        return (self.get_brush_fingerprint(brushstroke.brushid), brushstroke.xy.x, brushstroke.xy.y, brushstroke.scale, brushstroke.angle)
+
     def to_page_brushstroke_list(self)-> List[PageBrushstroke]:
-        return [ PageBrushstroke(self.get_brush_by_id(bs.brushid).vpath.rotate(bs.angle).scale(self.headers.brush_page_ratio).scale(bs.scale).translate(bs.xy), set(bs.tags)) for bs in self.brushstrokes]
+        return [ PageBrushstroke(self.get_rotated_scaled_brush(bs).transform(Affine2d.from_translation(bs.xy)), set(bs.tags)) for bs in self.brushstrokes]
+
+    def get_brush_radius(self, brushid: str)->float:
+        # rotations never lengthen a vector (cos and sin are truncated), so the
+        # farthest brush point bounds the brush under any rotation
+        points = self.get_brush_by_id(brushid).vpath.all_points()
+        if len(points) == 0:
+            return 0.0
+        return sqrt(float(max([pt.x*pt.x + pt.y*pt.y for pt in points]))) * (1 + 1e-9) + 1e-12
+
+    def get_spatial_index(self)->BrushstrokeGridIndex:
+        if self.spatial_index is None or self.spatial_index_ratio != self.headers.brush_page_ratio:
+            ratio = self.headers.brush_page_ratio
+            radii = {brushid: self.get_brush_radius(brushid) for brushid in self.get_used_brush_ids()}
+            # a brush without points has no extent, and the inside test decides on its own
+            pointless = {brushid for brushid in radii if len(self.get_brush_by_id(brushid).vpath.all_points()) == 0}
+            boxes = []
+            for bs in self.brushstrokes:
+                if bs.brushid in pointless:
+                    boxes.append(None)
+                    continue
+                radius = radii[bs.brushid] * abs(float(ratio * bs.scale))
+                x, y = float(bs.xy.x), float(bs.xy.y)
+                boxes.append((x - radius, y - radius, x + radius, y + radius))
+            self.spatial_index = BrushstrokeGridIndex.from_boxes(boxes)
+            self.spatial_index_ratio = ratio
+        return self.spatial_index
+
+    def get_tag_index(self)->TagBitmaskIndex:
+        if self.tag_index is None:
+            self.tag_index = TagBitmaskIndex([tag.id for tag in self.tag_descriptions])
+            self.stroke_tag_masks = [self.tag_index.to_mask(bs.tags) for bs in self.brushstrokes]
+            self.view_indices = {}
+        return self.tag_index
+
+    def get_stroke_tag_masks(self)->List[int]:
+        self.get_tag_index()
+        return self.stroke_tag_masks
+
+    def tag_indices_for_view(self, view: DlmtView)->List[int]:
+        tag_index = self.get_tag_index()
+        key = view.to_string()
+        if key not in self.view_indices:
+            view_mask = tag_index.get_view_mask(view)
+            self.view_indices[key] = [i for i, mask in enumerate(self.stroke_tag_masks) if tag_index.accept_mask(view, view_mask, mask)]
+        return self.view_indices[key]
+
+    def candidate_indices_for_view(self, view: DlmtView)->List[int]:
+        # only the strokes near the view can be inside it when the O flag is set
+        if "O" not in view.flags:
+            return self.tag_indices_for_view(view)
+        candidates = self.get_spatial_index().query((float(view.xy.x) - 1e-9, float(view.xy.y) - 1e-9, float(view.xy.x + view.width) + 1e-9, float(view.xy.y + view.height) + 1e-9))
+        tag_index = self.get_tag_index()
+        view_mask = tag_index.get_view_mask(view)
+        masks = self.stroke_tag_masks
+        return [i for i in candidates if tag_index.accept_mask(view, view_mask, masks[i])]
+
+    def _view_rect(self, view: DlmtView)->V2dRect:
+        # the zoom maps the view rectangle to the origin with a unit width
+        return V2dRect(V2d(Fraction(0), Fraction(0)), Fraction(1), view.height / view.width)
+
+    def _iter_view_brushstrokes(self, view: DlmtView, float_mode: bool = False, indices: List[int] = None, page = None, chunk_size: int = 1024):
+        # (index, inside, zoomed brushstroke) for the candidates of the view in order, inside
+        # being always true without the O flag. The brushstrokes are zoomed from a page
+        # list (or page batches in float mode) when given, else transformed one at a
+        # time (a chunk at a time in float mode)
+        indices = self.candidate_indices_for_view(view) if indices is None else indices
+        check_inside = "O" in view.flags
+        zoomed_rect = self._view_rect(view)
+        zoom = Affine2d.from_zoom(view.xy, view.width)
+        if float_mode:
+            float_zoom = zoom.to_float_tuple()
+            if page is not None:
+                selected = full(len(self.brushstrokes), False)
+                selected[indices] = True
+                chunks = [[batch.select(selected[batch.indices]).transform(float_zoom) for batch in page]]
+            else:
+                chunks = (self.to_page_brushstroke_batches(indices[start:start + chunk_size], float_zoom) for start in range(0, len(indices), chunk_size))
+            for batches in chunks:
+                ordered = []
+                for batch in batches:
+                    inside = batch.inside_rect_mask(zoomed_rect) if check_inside else full(len(batch), True)
+                    ordered += [(int(batch.indices[j]), bool(inside[j]), batch, j) for j in range(len(batch))]
+                ordered.sort(key = lambda item: item[0])
+                for i, inside, batch, j in ordered:
+                    yield i, inside, batch.get_float_page_brushstroke(j)
+            return
+        for i in indices:
+            if page is not None:
+                pbs = page[i].transform(zoom)
+            else:
+                bs = self.brushstrokes[i]
+                pbs = PageBrushstroke(self.get_rotated_scaled_brush(bs).transform(Affine2d.from_translation(bs.xy).then(zoom)), bs.get_tags_set())
+            yield i, not check_inside or pbs.is_inside_rect(zoomed_rect), pbs
 
     def page_brushstroke_list_for_view(self, view: DlmtView) -> List[PageBrushstroke]:
-        bs4tags = [pbs for pbs in self.to_page_brushstroke_list() if view.accept_tags(pbs.tags)]
-        bs4opt = [pbs for pbs in bs4tags if pbs.vpath.is_mostly_inside_rect(view.xy, width = view.width, height = view.height)] if "O" in view.flags else bs4tags
-        newbrushstokes = [pbs.zoom_to(view.xy, view.width) for pbs in bs4opt]
-        return newbrushstokes
+        return [pbs for _, inside, pbs in self._iter_view_brushstrokes(view) if inside]
 
     def page_brushstroke_list_for_view_string(self, view: str) -> List[PageBrushstroke]:
         return self.page_brushstroke_list_for_view(DlmtView.from_string(view))
 
-    def to_xml_svg(self, renderConfig: SvgRenderingConfig)->ElementTree:
-        svg = ET.Element('svg', attrib = { 
+    def get_brush_float_array(self, brushid: str)->VPathArray:
+        if brushid not in self.brush_arrays:
+            self.brush_arrays[brushid] = self.get_brush_by_id(brushid).vpath.to_float_array()
+        return self.brush_arrays[brushid]
+
+    def get_float_page_transform(self, brushstroke: DlmtBrushstroke):
+        return float_affine_from_transform(brushstroke.angle, self.headers.brush_page_ratio * brushstroke.scale, brushstroke.xy)
+
+    def get_float_page_matrices(self, brushstrokes: List[DlmtBrushstroke]):
+        ratio = self.headers.brush_page_ratio
+        rows = []
+        for bs in brushstrokes:
+            cosa, sina = TRIG_TABLE.cos_sin_float(bs.angle)
+            rows.append((cosa, sina, float(ratio * bs.scale), float(bs.xy.x), float(bs.xy.y)))
+        cosa, sina, k, e, f = array(rows, dtype=float64).reshape(len(rows), 5).T
+        return stack([k*cosa, -k*sina, k*sina, k*cosa, e, f], axis=1)
+
+    def to_page_brushstroke_batches(self, indices: List[int] = None, then = None)-> List[PageBrushstrokeBatch]:
+        indices = range(len(self.brushstrokes)) if indices is None else indices
+        groups = {}
+        for i in indices:
+            groups.setdefault(self.brushstrokes[i].brushid, []).append(i)
+        batches = []
+        for brushid, group in groups.items():
+            brushstrokes = [self.brushstrokes[i] for i in group]
+            matrices = self.get_float_page_matrices(brushstrokes)
+            if then is not None:
+                matrices = stack(float_affine_then(tuple(matrices.T), then), axis=1)
+            brush = self.get_brush_float_array(brushid)
+            batches.append(PageBrushstrokeBatch(brushid, array(group, dtype=int64), brush.transform_batch(matrices), brush, [bs.get_tags_set() for bs in brushstrokes]))
+        return batches
+
+    def to_page_brushstroke_arrays(self)-> List[FloatPageBrushstroke]:
+        ordered = [(i, batch.get_float_page_brushstroke(j)) for batch in self.to_page_brushstroke_batches() for j, i in enumerate(batch.indices)]
+        ordered.sort(key = lambda pair: pair[0])
+        return [pbs for _, pbs in ordered]
+
+    def float_page_brushstroke_list_for_view(self, view: DlmtView) -> List[FloatPageBrushstroke]:
+        return [pbs for _, inside, pbs in self._iter_view_brushstrokes(view, float_mode = True) if inside]
+
+    def render_views(self, views: List[DlmtView], widths: List[int], float_mode: bool = False) -> List[ElementTree]:
+        # the brushstrokes are moved to page space once and each view only culls, zooms and serializes
+        page = self.to_page_brushstroke_batches() if float_mode else self.to_page_brushstroke_list()
+        results = []
+        for view, width in zip(views, widths):
+            renderConfig = self.create_page_pixel_coordinate_with_view(width, view).set_float_mode(float_mode)
+            results.append(self.to_xml_svg(renderConfig, [pbs for _, inside, pbs in self._iter_view_brushstrokes(view, float_mode, page = page) if inside]))
+        return results
+
+    def iter_page_brushstrokes_for_rendering(self, renderConfig: SvgRenderingConfig, chunk_size: int = 1024):
+        # the same brushstrokes as page_brushstroke_list_for_rendering, transformed one at
+        # a time (a chunk at a time in float mode) so a streamed svg keeps a flat footprint
+        for _, inside, pbs in self._iter_view_brushstrokes(renderConfig.view, renderConfig.float_mode, chunk_size = chunk_size):
+            if inside:
+                yield pbs
+
+    def page_brushstroke_list_for_rendering(self, renderConfig: SvgRenderingConfig) -> List[Union[PageBrushstroke, FloatPageBrushstroke]]:
+        if renderConfig.float_mode:
+            return self.float_page_brushstroke_list_for_view(renderConfig.view)
+        return self.page_brushstroke_list_for_view(renderConfig.view)
+
+    def visible_indices_for_view(self, view: DlmtView, float_mode: bool = False)->List[int]:
+        if "O" not in view.flags:
+            return self.candidate_indices_for_view(view)
+        return [i for i, inside, _ in self._iter_view_brushstrokes(view, float_mode) if inside]
+
+    def _render_svg_fragments(self, renderConfig: SvgRenderingConfig, indices: List[int])->List[Tuple[bool, str]]:
+        # the same arithmetic as page_brushstroke_list_for_rendering, one (inside, path) per index
+        dpu, ypixoffset = float(renderConfig.view_pixel_width), float(renderConfig.view_pixel_height)
+        fragments = {}
+        for i, inside, pbs in self._iter_view_brushstrokes(renderConfig.view, renderConfig.float_mode, indices):
+            fragments[i] = (inside, pbs.vpath.to_svg_string(dpu, ypixoffset) if inside else "")
+        return [fragments[i] for i in indices]
+
+    def iter_svg_paths_for_rendering(self, renderConfig: SvgRenderingConfig):
+        # only the brushstrokes missing from the fragment cache are transformed and serialized
+        cache = self.svg_fragments if self.svg_fragments is not None else SvgFragmentCache(0)
+        render_key = (renderConfig.view.to_string(), renderConfig.view_pixel_width, renderConfig.view_pixel_height, renderConfig.float_mode, self.headers.brush_page_ratio)
+        indices = self.candidate_indices_for_view(renderConfig.view)
+        keys = [(render_key, self.get_brushstroke_fingerprint(self.brushstrokes[i])) for i in indices]
+        fragments = [cache.lookup(key) for key in keys]
+        missing = [n for n, fragment in enumerate(fragments) if fragment is None]
+        if len(missing) > 0:
+            for n, fragment in zip(missing, self._render_svg_fragments(renderConfig, [indices[n] for n in missing])):
+                fragments[n] = fragment
+                cache.put(keys[n], fragment)
+        for inside, path in fragments:
+            if inside:
+                yield path
+
+    def _symbol_transform(self, renderConfig: SvgRenderingConfig, brushstroke: DlmtBrushstroke)->str:
+        # the symbol is drawn around the brush origin, so translating last keeps
+        # the rotation and the scaling centred on the brushstroke position
+        x, y = renderConfig.to_svg_translate(brushstroke.xy)
+        if renderConfig.symbol_mode == SvgSymbolMode.TRANSFORM:
+            return "translate({:.3f} {:.3f})".format(x, y)
+        scale = float(brushstroke.scale)
+        if brushstroke.angle == 0:
+            return "translate({:.3f} {:.3f})".format(x, y) if brushstroke.scale == 1 else "translate({:.3f} {:.3f}) scale({:.5f})".format(x, y, scale)
+        cosa, sina = TRIG_TABLE.cos_sin_float(brushstroke.angle)
+        return "matrix({:.5f} {:.5f} {:.5f} {:.5f} {:.3f} {:.3f})".format(scale*cosa, -scale*sina, scale*sina, scale*cosa, x, y)
+
+    def _symbol_key(self, renderConfig: SvgRenderingConfig, brushstroke: DlmtBrushstroke):
+        if renderConfig.symbol_mode == SvgSymbolMode.TRANSFORM:
+            return (brushstroke.brushid, brushstroke.angle, brushstroke.scale)
+        return (brushstroke.brushid,)
+
+    def _symbol_path(self, renderConfig: SvgRenderingConfig, brushstroke: DlmtBrushstroke)->str:
+        if renderConfig.symbol_mode == SvgSymbolMode.TRANSFORM:
+            return self.get_rotated_scaled_brush(brushstroke).to_svg_string(float(renderConfig.get_page_pixel_ratio()), 0)
+        return self.get_brush_by_id(brushstroke.brushid).vpath.to_svg_string(float(renderConfig.brush_width), 0)
+
+    def _iter_xml_svg_symbols(self, renderConfig: SvgRenderingConfig):
+        # all the symbols are needed before the first use, so the keys are collected first
+        visible = [self.brushstrokes[i] for i in self.visible_indices_for_view(renderConfig.view, renderConfig.float_mode)]
+        defs = ET.Element('defs')
+        symbols = {}
+        for bs in visible:
+            key = self._symbol_key(renderConfig, bs)
+            if key not in symbols:
+                symbols[key] = "s{}-{}".format(len(symbols), as_tidy_name(bs.brushid))
+                symbol = ET.SubElement(defs, 'symbol', attrib = { "id": symbols[key], "overflow": "visible" })
+                ET.SubElement(symbol, 'path', attrib = { "d": self._symbol_path(renderConfig, bs) })
+        yield defs
+        for bs in visible:
+            yield ET.Element('use', attrib = { "xlink:href": "#" + symbols[self._symbol_key(renderConfig, bs)], "transform": self._symbol_transform(renderConfig, bs) })
+
+    def _xml_svg_root(self, renderConfig: SvgRenderingConfig):
+        return ET.Element('svg', attrib = { 
             "xmlns": "http://www.w3.org/2000/svg",
             "xmlns:xlink": "http://www.w3.org/1999/xlink",
             "xmlns:dc": "http://purl.org/dc/elements/1.1/",
@@ -723,10 +1327,287 @@ class DalmatianMedia:
             "xmlns:svg": "http://www.w3.org/2000/svg",
             "viewBox": renderConfig.to_page_view_box()
             })
-        svg.append(self.headers.to_xml_svg(lang = "en"))
-        for pbs in self.page_brushstroke_list_for_view(renderConfig.view):
-            svg.append(pbs.to_xml_svg(renderConfig))
+
+    def iter_xml_svg_elements(self, renderConfig: SvgRenderingConfig, page_brushstrokes: List[Union[PageBrushstroke, FloatPageBrushstroke]] = None):
+        yield self.headers.to_xml_svg(lang = "en")
+        if renderConfig.symbol_mode in [SvgSymbolMode.BRUSH, SvgSymbolMode.TRANSFORM] and page_brushstrokes is None:
+            yield from self._iter_xml_svg_symbols(renderConfig)
+            return
+        if page_brushstrokes is None and self.svg_fragments is not None:
+            for path in self.iter_svg_paths_for_rendering(renderConfig):
+                yield ET.Element('path', attrib = { "d": path })
+            return
+        if page_brushstrokes is None:
+            page_brushstrokes = self.iter_page_brushstrokes_for_rendering(renderConfig)
+        for pbs in page_brushstrokes:
+            yield pbs.to_xml_svg(renderConfig)
+
+    def to_xml_svg(self, renderConfig: SvgRenderingConfig, page_brushstrokes: List[Union[PageBrushstroke, FloatPageBrushstroke]] = None)->ElementTree:
+        svg = self._xml_svg_root(renderConfig)
+        svg.extend(self.iter_xml_svg_elements(renderConfig, page_brushstrokes))
         return ElementTree(svg)
 
+    def write_xml_svg(self, renderConfig: SvgRenderingConfig, file_or_filename, compatible: bool = True, page_brushstrokes: List[Union[PageBrushstroke, FloatPageBrushstroke]] = None):
+        writer = SvgStreamWriter(file_or_filename, compatible)
+        try:
+            writer.start(self._xml_svg_root(renderConfig))
+            for element in self.iter_xml_svg_elements(renderConfig, page_brushstrokes):
+                writer.write(element)
+            writer.end()
+        finally:
+            writer.close()
+
     def to_xml_svg_file(self, renderConfig: SvgRenderingConfig , file_or_filename):
-        self.to_xml_svg(renderConfig).write(file_or_filename, encoding='UTF-8')
\ No newline at end of file
+        self.write_xml_svg(renderConfig, file_or_filename)
+
+# Writes an svg element by element instead of building the whole tree. In the
+# compatible mode the bytes are the same as ElementTree.write(encoding='UTF-8'),
+# otherwise an xml declaration is added and each element gets its own line.
+class SvgStreamWriter:
+    def __init__(self, file_or_filename, compatible: bool = True, buffer_size: int = 1 << 16):
+        self.owned = isinstance(file_or_filename, str)
+        self.out = open(file_or_filename, "wb") if self.owned else file_or_filename
+        self.compatible = compatible
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.pending = 0
+        self.end_tag = ""
+
+    def _append(self, text: str):
+        self.parts.append(text)
+        self.pending += len(text)
+        if self.pending >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.parts) > 0:
+            self.out.write("".join(self.parts).encode("utf-8"))
+            self.parts = []
+            self.pending = 0
+        return self
+
+    def start(self, root):
+        # serializing the root around a marker child gives the exact start and end tags
+        marker = ET.SubElement(root, 'marker')
+        start_tag, self.end_tag = ET.tostring(root, encoding = "unicode").split(ET.tostring(marker, encoding = "unicode"))
+        root.remove(marker)
+        if not self.compatible:
+            self._append("<?xml version='1.0' encoding='UTF-8'?>\n")
+        self._append(start_tag)
+        return self
+
+    def write(self, element):
+        self._append(ET.tostring(element, encoding = "unicode") if self.compatible else "\n" + ET.tostring(element, encoding = "unicode"))
+        return self
+
+    def end(self):
+        self._append(self.end_tag if self.compatible else "\n" + self.end_tag + "\n")
+        return self.flush()
+
+    def close(self):
+        self.flush()
+        if self.owned:
+            self.out.close()
+
+DLMT_SECTIONS = ["header", "views", "tag-descriptions", "brushes", "brushstrokes"]
+DLMT_SECTION_KEYS = {"header": ":", "views": "view ", "tag-descriptions": "tag ", "brushes": "brush ", "brushstrokes": "brushstroke "}
+
+def iter_dlmt_lines(source):
+    # works with text files, binary files and mmap objects
+    readline = source.readline
+    while True:
+        line = readline()
+        if not line:
+            return
+        yield line.decode("utf-8") if isinstance(line, bytes) else line
+
+# Reads a .dlmt file in a single pass: the sections before the brushstrokes
+# are parsed into a media, then the brushstrokes are parsed as they are read
+class DlmtReader:
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.media = None
+
+    @classmethod
+    def from_file(cls, file_or_mmap):
+        return cls(iter_dlmt_lines(file_or_mmap))
+
+    def read_head(self)->DalmatianMedia:
+        if self.media is not None:
+            return self.media
+        collected = {section: [] for section in DLMT_SECTIONS}
+        expected = iter(DLMT_SECTIONS)
+        section = None
+        for rawline in self.lines:
+            line = rawline.strip()
+            if line == "" or line == "--------":
+                continue
+            if line.startswith("section "):
+                section = line[len("section "):]
+                assert section == next(expected, None), line
+                if section == "brushstrokes":
+                    break
+            else:
+                assert section is not None, line
+                if DLMT_SECTION_KEYS[section] in line:
+                    collected[section].append(line)
+        assert section == "brushstrokes", "section brushstrokes"
+        dlmtheaders = DlmtHeaders.from_string_list(collected["header"])
+        dlmtviews = [DlmtView.from_string(view) for view in collected["views"]]
+        dlmttag_descriptions = [DlmtTagDescription.from_string(tagdesc) for tagdesc in collected["tag-descriptions"]]
+        dlmtbrushes = DlmtBrush.from_string_list(collected["brushes"])
+        self.media = DalmatianMedia(dlmtheaders).set_views(dlmtviews).set_tag_descriptions(dlmttag_descriptions).set_brushes(dlmtbrushes)
+        return self.media
+
+    def iter_brushstrokes(self):
+        self.read_head()
+        for rawline in self.lines:
+            line = rawline.strip()
+            if DLMT_SECTION_KEYS["brushstrokes"] in line:
+                yield DlmtBrushstroke.from_string(line)
+
+    def read(self)->DalmatianMedia:
+        media = self.read_head()
+        return media.set_brushstrokes(list(self.iter_brushstrokes()))
+
+# .dlmtb layout: the magic, the length of a json block, the json block (headers,
+# views, tag descriptions, brush ids, tags and the array table) padded to 8 bytes,
+# then the packed arrays. Fractions are stored as int64 numerator/denominator pairs.
+DLMTB_MAGIC = b"DLMTB001"
+DLMTB_MAX_TAGS = 64
+INT64_MAX = 2**63 - 1
+
+def _fraction_pairs(fractions: List[Fraction]):
+    pairs = [(f.numerator, f.denominator) for f in fractions]
+    for numerator, denominator in pairs:
+        if abs(numerator) > INT64_MAX or denominator > INT64_MAX:
+            raise OverflowError("Fraction does not fit in int64: {}/{}".format(numerator, denominator))
+    return array(pairs, dtype=int64).reshape(len(pairs), 2)
+
+def _pairs_to_fractions(values)->List[Fraction]:
+    return [Fraction(numerator, denominator) for numerator, denominator in values.reshape(-1, 2).tolist()]
+
+class DlmtBinary:
+    def __init__(self, meta, arrays, buffer = None):
+        self.meta = meta
+        self.arrays = arrays
+        self.buffer = buffer
+
+    @classmethod
+    def from_media(cls, media: DalmatianMedia):
+        brushes = media.get_sorted_brushes()
+        brush_index = {brush.id: i for i, brush in enumerate(brushes)}
+        tag_index = media.get_tag_index()
+        if len(tag_index) > DLMTB_MAX_TAGS:
+            raise Exception("Too many tags for the binary format: {}".format(len(tag_index)))
+        tag_lists = {}
+        opcodes, segment_offsets, point_offsets, points = [], [0], [0], []
+        for brush in brushes:
+            for segment in brush.vpath.segments:
+                opcodes.append(segment.action.value)
+                points += segment.get_points()
+            segment_offsets.append(len(opcodes))
+            point_offsets.append(len(points))
+        strokes = media.brushstrokes
+        arrays = {
+            "brush-segments": array(segment_offsets, dtype=int64),
+            "brush-points": array(point_offsets, dtype=int64),
+            "opcodes": array(opcodes, dtype=uint8),
+            "points": _fraction_pairs([v for pt in points for v in [pt.x, pt.y]]).reshape(len(points), 4),
+            "stroke-brush": array([brush_index[bs.brushid] for bs in strokes], dtype=int32),
+            "stroke-values": _fraction_pairs([v for bs in strokes for v in [bs.xy.x, bs.xy.y, bs.scale, bs.angle]]).reshape(len(strokes), 8),
+            "stroke-tags": array([tag_lists.setdefault(tuple(bs.tags), len(tag_lists)) for bs in strokes], dtype=int32),
+            "stroke-tag-mask": array(media.get_stroke_tag_masks(), dtype=uint64)
+        }
+        meta = {
+            "headers": media.headers.to_string_list(),
+            "views": [str(view) for view in media.get_sorted_views()],
+            "tag-descriptions": [str(tag_desc) for tag_desc in media.tag_descriptions],
+            "brushes": [[brush.id, brush.ext_id] for brush in brushes],
+            "tags": tag_index.get_tag_ids(),
+            "tag-lists": [list(tag_list) for tag_list in tag_lists]
+        }
+        return cls(meta, arrays)
+
+    def to_bytes(self)->bytes:
+        table = []
+        offset = 0
+        for name, values in self.arrays.items():
+            table.append([name, values.dtype.str, list(values.shape), offset])
+            offset += (values.nbytes + 7) // 8 * 8
+        meta = dict(self.meta, arrays = table)
+        block = json.dumps(meta).encode("utf-8")
+        block += b" " * (-len(block) % 8)
+        parts = [DLMTB_MAGIC, array([len(block)], dtype="<i8").tobytes(), block]
+        for values in self.arrays.values():
+            raw = values.tobytes()
+            parts += [raw, b"\0" * (-len(raw) % 8)]
+        return b"".join(parts)
+
+    def write(self, file_or_filename):
+        if isinstance(file_or_filename, str):
+            with open(file_or_filename, "wb") as binfile:
+                binfile.write(self.to_bytes())
+        else:
+            file_or_filename.write(self.to_bytes())
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        # the arrays are views over the buffer, nothing is copied
+        assert bytes(buffer[0:8]) == DLMTB_MAGIC, "Not a dlmtb file"
+        length = int(frombuffer(buffer, dtype="<i8", count=1, offset=8)[0])
+        meta = json.loads(bytes(buffer[16:16+length]).decode("utf-8"))
+        start = 16 + length
+        arrays = {}
+        for name, dtype_str, shape, offset in meta.pop("arrays"):
+            count = 1
+            for dim in shape:
+                count *= dim
+            arrays[name] = frombuffer(buffer, dtype=dtype_str, count=count, offset=start+offset).reshape(shape)
+        return cls(meta, arrays, buffer)
+
+    @classmethod
+    def open(cls, filename: str):
+        with open(filename, "rb") as binfile:
+            return cls.from_buffer(mmap.mmap(binfile.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self):
+        self.arrays = {}
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.buffer = None
+
+    def get_brushes(self)->List[DlmtBrush]:
+        segment_offsets = self.arrays["brush-segments"].tolist()
+        point_offsets = self.arrays["brush-points"].tolist()
+        opcodes = self.arrays["opcodes"].tolist()
+        fractions = _pairs_to_fractions(self.arrays["points"])
+        brushes = []
+        for i, (brushid, ext_id) in enumerate(self.meta["brushes"]):
+            segments = []
+            position = point_offsets[i]
+            for opcode in opcodes[segment_offsets[i]:segment_offsets[i+1]]:
+                action = SegmentShape(opcode)
+                count = SegmentShape.count_of_points(action)
+                segments.append(VSegment.from_points(action, [V2d(fractions[2*k], fractions[2*k+1]) for k in range(position, position + count)]))
+                position += count
+            brushes.append(DlmtBrush(brushid, ext_id, VPath(segments)))
+        return brushes
+
+    def iter_brushstrokes(self):
+        brushids = [brushid for brushid, _ in self.meta["brushes"]]
+        tag_lists = self.meta["tag-lists"]
+        fractions = _pairs_to_fractions(self.arrays["stroke-values"])
+        for i, (brush, tags) in enumerate(zip(self.arrays["stroke-brush"].tolist(), self.arrays["stroke-tags"].tolist())):
+            x, y, scale, angle = fractions[4*i:4*i+4]
+            yield DlmtBrushstroke(brushids[brush], V2d(x, y), scale, angle, list(tag_lists[tags]))
+
+    def to_media(self)->DalmatianMedia:
+        media = DalmatianMedia.from_obj({
+            "headers": self.meta["headers"],
+            "views": self.meta["views"],
+            "tag-descriptions": self.meta["tag-descriptions"],
+            "brushes": [],
+            "brushstrokes": []
+        })
+        return media.set_brushes(self.get_brushes()).set_brushstrokes(list(self.iter_brushstrokes()))
@@ -0,0 +1,237 @@
+import re
+import zlib
+import struct
+from multiprocessing import Pool
+from math import ceil, floor, sqrt
+from typing import List, Tuple
+from PIL import Image, ImageColor
+from numpy import array, zeros, arange, linspace, concatenate, argsort, take_along_axis, cumsum, clip, where, inf, isfinite, float64, int64, uint8, add
+from dalmatianmedia import DalmatianMedia, SvgRenderingConfig
+
+PATTERN_SVG_PATH_TOKEN = re.compile(r"([MLCSQTZE])|(-?[0-9]*\.?[0-9]+(?:e-?[0-9]+)?)")
+
+# maximum length in (supersampled) pixels of a chord when flattening a curve
+CURVE_FLATNESS = 1.0
+MAX_CURVE_STEPS = 64
+
+# M 1 2 L 3 4 Z -> [("M", [1.0, 2.0]), ("L", [3.0, 4.0]), ("Z", [])]
+def parse_svg_path(d: str)->List[Tuple[str, List[float]]]:
+    commands = []
+    for letter, number in PATTERN_SVG_PATH_TOKEN.findall(d):
+        if letter != "":
+            commands.append((letter, []))
+        elif len(commands) > 0:
+            commands[-1][1].append(float(number))
+    return commands
+
+def _curve_steps(points)->int:
+    length = sum([sqrt((x1 - x0)**2 + (y1 - y0)**2) for (x0, y0), (x1, y1) in zip(points[:-1], points[1:])])
+    return max(2, min(MAX_CURVE_STEPS, int(ceil(length / CURVE_FLATNESS))))
+
+def _cubic_points(p0, p1, p2, p3):
+    t = linspace(0, 1, _curve_steps([p0, p1, p2, p3]) + 1)[1:, None]
+    u = 1 - t
+    return u**3 * array(p0) + 3 * u**2 * t * array(p1) + 3 * u * t**2 * array(p2) + t**3 * array(p3)
+
+def _quadratic_points(p0, p1, p2):
+    t = linspace(0, 1, _curve_steps([p0, p1, p2]) + 1)[1:, None]
+    u = 1 - t
+    return u**2 * array(p0) + 2 * u * t * array(p1) + t**2 * array(p2)
+
+def _ceil_int(values):
+    return (-(-values // 1)).astype(int64)
+
+def _reflect(control, current):
+    return (2 * current[0] - control[0], 2 * current[1] - control[1])
+
+# Turns the commands of an svg path into polygons, one per subpath.
+# S and T reflect the previous control point like svg does.
+def flatten_svg_path(commands: List[Tuple[str, List[float]]], scale: float = 1.0):
+    polygons = []
+    current_polygon = []
+    current = (0.0, 0.0)
+    start = (0.0, 0.0)
+    last_cubic = None
+    last_quadratic = None
+    def close():
+        if len(current_polygon) > 0:
+            polygon = concatenate([array(part, dtype = float64).reshape(-1, 2) for part in current_polygon])
+            if len(polygon) > 2:
+                polygons.append(polygon)
+    for letter, numbers in commands:
+        points = [(numbers[2*i] * scale, numbers[2*i+1] * scale) for i in range(len(numbers) // 2)]
+        cubic, quadratic = None, None
+        if letter == "M" and len(points) == 1:
+            close()
+            current_polygon = [[points[0]]]
+            current = start = points[0]
+        elif letter == "L" and len(points) == 1:
+            current_polygon.append([points[0]])
+            current = points[0]
+        elif letter == "C" and len(points) == 3:
+            current_polygon.append(_cubic_points(current, points[0], points[1], points[2]))
+            cubic, current = points[1], points[2]
+        elif letter == "S" and len(points) == 2:
+            first = _reflect(last_cubic, current) if last_cubic is not None else current
+            current_polygon.append(_cubic_points(current, first, points[0], points[1]))
+            cubic, current = points[0], points[1]
+        elif letter == "Q" and len(points) == 2:
+            current_polygon.append(_quadratic_points(current, points[0], points[1]))
+            quadratic, current = points[0], points[1]
+        elif letter == "T" and len(points) == 1:
+            control = _reflect(last_quadratic, current) if last_quadratic is not None else current
+            current_polygon.append(_quadratic_points(current, control, points[0]))
+            quadratic, current = control, points[0]
+        elif letter == "Z":
+            close()
+            current_polygon = [[start]]
+            current = start
+        last_cubic, last_quadratic = cubic, quadratic
+    close()
+    return polygons
+
+# A boolean canvas, supersampled, on which filled paths are scan converted
+# with the nonzero rule of svg
+class RasterCanvas:
+    def __init__(self, width: int, height: int, supersampling: int = 1, origin: Tuple[int, int] = (0, 0)):
+        self.width = width
+        self.height = height
+        self.supersampling = supersampling
+        # the top left pixel of this canvas in a larger image, used by the tiles
+        self.origin = origin
+        self.pixels = zeros((height * supersampling, width * supersampling), dtype = bool)
+
+    def fill_polygons(self, polygons):
+        # every polygon is implicitly closed, as svg does when filling
+        edges = [(polygon, concatenate([polygon[1:], polygon[:1]])) for polygon in polygons if len(polygon) > 2]
+        if len(edges) == 0:
+            return self
+        starts = concatenate([start for start, _ in edges])
+        ends = concatenate([end for _, end in edges])
+        x0, y0, x1, y1 = starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+        sloped = y0 != y1
+        x0, y0, x1, y1 = x0[sloped], y0[sloped], x1[sloped], y1[sloped]
+        if len(x0) == 0:
+            return self
+        rows, cols = self.pixels.shape
+        # the scan works in the coordinates of the whole image, so a tile gives
+        # exactly the same pixels as a single canvas would
+        left_offset, top_offset = self.origin[0] * self.supersampling, self.origin[1] * self.supersampling
+        top = max(top_offset, int(floor(min(y0.min(), y1.min()) - 0.5)))
+        bottom = min(top_offset + rows - 1, int(ceil(max(y0.max(), y1.max()) - 0.5)))
+        if bottom < top:
+            return self
+        # the scanlines go through the centre of the pixels
+        ys = arange(top, bottom + 1, dtype = float64)[:, None] + 0.5
+        ymin, ymax = where(y0 < y1, y0, y1), where(y0 < y1, y1, y0)
+        active = (ys >= ymin) & (ys < ymax)
+        xs = where(active, x0 + (ys - y0) * (x1 - x0) / (y1 - y0), inf)
+        winding = where(active, where(y1 > y0, 1, -1), 0)
+        order = argsort(xs, axis = 1)
+        xs = take_along_axis(xs, order, axis = 1)
+        winding = cumsum(take_along_axis(winding, order, axis = 1), axis = 1)
+        inside = (winding[:, :-1] != 0) & isfinite(xs[:, 1:])
+        row_index, span_index = inside.nonzero()
+        if len(row_index) == 0:
+            return self
+        left = clip(_ceil_int(xs[row_index, span_index] - 0.5) - left_offset, 0, cols)
+        right = clip(_ceil_int(xs[row_index, span_index + 1] - 0.5) - left_offset, 0, cols)
+        # only the columns spanned by the path are accumulated
+        first, last = int(left.min()), int(right.max())
+        coverage = zeros((bottom - top + 1, last - first + 1), dtype = int64)
+        add.at(coverage, (row_index, left - first), 1)
+        add.at(coverage, (row_index, right - first), -1)
+        self.pixels[top - top_offset:bottom - top_offset + 1, first:last] |= cumsum(coverage, axis = 1)[:, :last - first] > 0
+        return self
+
+    def fill_svg_path(self, d: str):
+        return self.fill_polygons(flatten_svg_path(parse_svg_path(d), self.supersampling))
+
+    def get_coverage(self):
+        # fraction of each output pixel that is painted
+        s = self.supersampling
+        return self.pixels.reshape(self.height, s, self.width, s).mean(axis = (1, 3))
+
+    def to_rgb(self, background: str = "white", color: str = "black"):
+        return coverage_to_rgb(self.get_coverage(), background, color)
+
+    def to_image(self, background: str = "white", color: str = "black")->Image:
+        return Image.fromarray(self.to_rgb(background, color))
+
+def coverage_to_rgb(coverage, background: str = "white", color: str = "black"):
+    back = array(ImageColor.getrgb(background)[:3], dtype = float64)
+    fore = array(ImageColor.getrgb(color)[:3], dtype = float64)
+    return (back * (1 - coverage[:, :, None]) + fore * coverage[:, :, None]).round().astype(uint8)
+
+def rasterize_media(media: DalmatianMedia, renderConfig: SvgRenderingConfig, supersampling: int = 2)->RasterCanvas:
+    canvas = RasterCanvas(int(round(renderConfig.view_pixel_width)), int(round(renderConfig.view_pixel_height)), supersampling)
+    for pbs in media.page_brushstroke_list_for_rendering(renderConfig):
+        canvas.fill_svg_path(pbs.to_xml_svg(renderConfig).get("d"))
+    return canvas
+
+def write_media_png(media: DalmatianMedia, renderConfig: SvgRenderingConfig, filename: str, background: str = "white", supersampling: int = 2):
+    rasterize_media(media, renderConfig, supersampling).to_image(background).save(filename)
+
+# Large images are rendered in tiles: the paths are culled per tile with their
+# bounding box, the tiles of a band are rendered by a pool of processes and
+# each band is streamed to the png before the next one is started.
+
+def _path_bounding_box(d: str)->Tuple[float, float, float, float]:
+    # the control points contain the curves, so their box contains the path
+    numbers = [number for _, numbers in parse_svg_path(d) for number in numbers]
+    if len(numbers) < 2:
+        return (inf, inf, -inf, -inf)
+    return (min(numbers[0::2]), min(numbers[1::2]), max(numbers[0::2]), max(numbers[1::2]))
+
+def _render_tile(task):
+    paths, width, height, supersampling, origin = task
+    canvas = RasterCanvas(width, height, supersampling, origin)
+    for d in paths:
+        canvas.fill_svg_path(d)
+    return canvas.get_coverage()
+
+def iter_tiled_coverage(paths: List[str], width: int, height: int, supersampling: int = 2, tile_size: int = 1024, workers: int = 1):
+    boxes = array([_path_bounding_box(d) for d in paths], dtype = float64).reshape(len(paths), 4)
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        for top in range(0, height, tile_size):
+            band_height = min(tile_size, height - top)
+            tasks = []
+            for left in range(0, width, tile_size):
+                tile_width = min(tile_size, width - left)
+                inside = (boxes[:, 0] <= left + tile_width) & (boxes[:, 2] >= left) & (boxes[:, 1] <= top + band_height) & (boxes[:, 3] >= top)
+                tasks.append(([paths[i] for i in inside.nonzero()[0]], tile_width, band_height, supersampling, (left, top)))
+            tiles = pool.map(_render_tile, tasks) if pool is not None else [_render_tile(task) for task in tasks]
+            yield concatenate(tiles, axis = 1)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def _png_chunk(kind: bytes, data: bytes)->bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+def write_png_rows(file_or_filename, width: int, height: int, bands):
+    # bands are (rows, width, 3) uint8 arrays, written as soon as they are given
+    out = open(file_or_filename, "wb") if isinstance(file_or_filename, str) else file_or_filename
+    try:
+        out.write(b"\x89PNG\r\n\x1a\n")
+        out.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        compressor = zlib.compressobj()
+        for band in bands:
+            # each row starts with the filter type, 0 for none
+            rows = concatenate([zeros((band.shape[0], 1), dtype = uint8), band.reshape(band.shape[0], width * 3)], axis = 1)
+            data = compressor.compress(rows.tobytes())
+            if len(data) > 0:
+                out.write(_png_chunk(b"IDAT", data))
+        out.write(_png_chunk(b"IDAT", compressor.flush()))
+        out.write(_png_chunk(b"IEND", b""))
+    finally:
+        if isinstance(file_or_filename, str):
+            out.close()
+
+def write_media_png_tiled(media: DalmatianMedia, renderConfig: SvgRenderingConfig, filename: str, background: str = "white", supersampling: int = 2, tile_size: int = 1024, workers: int = 1):
+    width, height = int(round(renderConfig.view_pixel_width)), int(round(renderConfig.view_pixel_height))
+    paths = [pbs.to_xml_svg(renderConfig).get("d") for pbs in media.page_brushstroke_list_for_rendering(renderConfig)]
+    bands = (coverage_to_rgb(coverage, background) for coverage in iter_tiled_coverage(paths, width, height, supersampling, tile_size, workers))
+    write_png_rows(filename, width, height, bands)
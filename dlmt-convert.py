@@ -0,0 +1,27 @@
+import os
+import argparse
+from glob import glob
+from dalmatianmedia import DalmatianMedia
+
+parser = argparse.ArgumentParser(description = 'Convert Dalmatian Mask Tape media between the text (dlmt) and binary (dlmtb) formats')
+parser.add_argument("-i", "--indirectory", help="Directory containing the Dalmatian Mask Tape media files", required = True)
+parser.add_argument("-o", "--outdirectory", help="Output directory", required = True)
+parser.add_argument("-t", "--to", help="Target format (dlmtb, dlmt)", default = "dlmtb")
+args = parser.parse_args()
+
+source_ext = "dlmt" if args.to == "dlmtb" else "dlmtb"
+
+def convert(filename: str):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    outname = "{}/{}.{}".format(args.outdirectory, name, args.to)
+    if args.to == "dlmtb":
+        with open(filename, 'r') as dlmtfile:
+            DalmatianMedia.from_file(dlmtfile).to_binary_file(outname)
+    else:
+        with open(outname, 'w') as outfile:
+            outfile.write(DalmatianMedia.from_binary_file(filename).to_string())
+
+for filename in glob("{}/*.{}".format(args.indirectory, source_ext)):
+    convert(filename)
+    print(".", end="", flush=True)
+print("")
@@ -6,7 +6,8 @@ from glob import glob
 from datetime import date
 from time import sleep, time
 from typing import List, Tuple, Dict, Set
-from dalmatianmedia import DlmtView, DalmatianMedia, SvgRenderingConfig
+from dalmatianmedia import DlmtView, DalmatianMedia, SvgRenderingConfig, SvgSymbolMode, as_tidy_name
+from dalmatianraster import write_media_png, write_media_png_tiled
 
 today = date.today()
 started = time()
@@ -17,33 +18,79 @@ parser.add_argument("-o", "--outdirectory", help="Output directory", required =
 parser.add_argument("-f", "--format", help="Image format (svg, png)", default = "svg")
 parser.add_argument("-p", "--prefix", help="Prefix for the generated media files", default = "")
 parser.add_argument("-W", "--width", help="The width of generated bitmap in pixels.", required = True)
-parser.add_argument("-v", "--view", help="The view to export (default, cropped, i:0...)", default = "default")
+parser.add_argument("-v", "--view", help="The view to export (default, cropped, all, i:0...)", default = "default")
 parser.add_argument("-b", "--background", help="Background color", default = "white")
+parser.add_argument("-r", "--rendering", help="Rendering arithmetic (exact, float)", default = "exact")
+parser.add_argument("--rasterizer", help="How png files are made (native, inkscape)", default = "native")
+parser.add_argument("--supersampling", help="Supersampling factor of the native rasterizer", default = "2")
+parser.add_argument("--tile-size", help="Render the png in square tiles of this size in pixels (0 for a single pass)", default = "0")
+parser.add_argument("--workers", help="Number of processes rendering the tiles", default = "1")
+parser.add_argument("-s", "--symbols", help="Share the brushes as svg symbols (none, brush, transform)", default = "none")
 args = parser.parse_args()
 
-dlmtfiles = glob("{}/*.dlmt".format(args.indirectory))
+symbol_mode = SvgSymbolMode.from_string(args.symbols)
+if symbol_mode == SvgSymbolMode.NOT_SUPPORTED:
+    raise Exception("Svg symbol mode not supported: {}".format(args.symbols))
+
+dlmtfiles = glob("{}/*.dlmt".format(args.indirectory)) + glob("{}/*.dlmtb".format(args.indirectory))
 
 default_view = DlmtView.from_string("view i:1 lang en xy 0 0 width 1 height 1 flags o tags all but [  ] -> everything")
 
 def read_dlmt_file(filename: str)->DalmatianMedia:
+    if filename.endswith(".dlmtb"):
+        return DalmatianMedia.from_binary_file(filename)
     with open(filename, 'r') as dlmtfile:
-        return DalmatianMedia.from_string(dlmtfile.read())
+        return DalmatianMedia.from_file(dlmtfile)
 
 def write_png(filename: str, color: str):
     os.popen("inkscape --export-type=png --export-background '{}' {}".format(color, filename))
 
+def write_native_png(media: DalmatianMedia, config: SvgRenderingConfig, filename: str):
+    pngname = filename.replace(".svg", ".png")
+    if int(args.tile_size) > 0:
+        write_media_png_tiled(media, config, pngname, args.background, int(args.supersampling), int(args.tile_size), int(args.workers))
+    else:
+        write_media_png(media, config, pngname, args.background, int(args.supersampling))
+
+def write_media_svg(media: DalmatianMedia, config: SvgRenderingConfig, filename: str):
+    media.to_xml_svg_file(config, filename)
+    if "png" not in args.format:
+        return
+    if args.rasterizer == "inkscape":
+        write_png(filename, args.background)
+    else:
+        write_native_png(media, config, filename)
+
+def render_config(config: SvgRenderingConfig)->SvgRenderingConfig:
+    return config.set_float_mode(args.rendering == "float").set_symbol_mode(symbol_mode)
+
+def write_all_views(media: DalmatianMedia):
+    views = media.get_sorted_views()
+    if symbol_mode == SvgSymbolMode.NONE:
+        rendered = media.render_views(views, [int(args.width)] * len(views), float_mode = args.rendering == "float")
+    else:
+        rendered = [media.to_xml_svg(render_config(media.create_page_pixel_coordinate_with_view(int(args.width), view))) for view in views]
+    for view, tree in zip(views, rendered):
+        filename = "{}/{}{}-{}.svg".format(args.outdirectory,args.prefix, media.headers.get_text("name", "en"), as_tidy_name(view.id))
+        tree.write(filename, encoding='UTF-8')
+        if "png" in args.format and args.rasterizer == "inkscape":
+            write_png(filename, args.background)
+        elif "png" in args.format:
+            write_native_png(media, render_config(media.create_page_pixel_coordinate_with_view(int(args.width), view)), filename)
+
 def write_media(media: DalmatianMedia):
+    if args.view == "all":
+        write_all_views(media)
+        return
     filename = "{}/{}{}.svg".format(args.outdirectory,args.prefix, media.headers.get_text("name", "en"))
     if args.view == "default":
-        media.to_xml_svg_file(media.create_page_pixel_coordinate_with_view(int(args.width), default_view), filename)
+        write_media_svg(media, render_config(media.create_page_pixel_coordinate_with_view(int(args.width), default_view)), filename)
     elif args.view == "cropped":
         rect = media.get_brushstokes_points().get_containing_rect()
         cropped_view = DlmtView.from_string("view i:2 lang en xy {} width {} height {} flags o tags all but [  ] -> cropped ".format(rect.xy, rect.width, rect.height))
-        media.to_xml_svg_file(media.create_page_pixel_coordinate_with_view(int(args.width), cropped_view), filename)
+        write_media_svg(media, render_config(media.create_page_pixel_coordinate_with_view(int(args.width), cropped_view)), filename)
     else:
-        media.to_xml_svg_file(media.create_page_pixel_coordinate(args.view, int(args.width)), filename)
-    if "png" in args.format:
-        write_png(filename, args.format)
+        write_media_svg(media, render_config(media.create_page_pixel_coordinate(args.view, int(args.width))), filename)
 
 for filename in dlmtfiles:
     media = read_dlmt_file(filename)
@@ -1,22 +1,188 @@
+import re
 from fractions import Fraction
-from typing import List, Tuple
+from functools import lru_cache
+from typing import List, Tuple, Dict
+from collections import OrderedDict
 from enum import Enum, auto
 from random import sample, choice
-from math import pi, radians, cos, sin, atan, degrees
-from numpy import corrcoef
+from math import pi, radians, cos, sin, atan, degrees, sqrt, nan
+from numpy import corrcoef, array, int64, float64, gcd, where, argpartition, concatenate, zeros, ones, stack
+
+TRIG_DENOMINATOR = 1000
+COMMON_ANGLE_DENOMINATORS = [1, 2, 3, 4, 5, 6, 8, 9, 10, 12, 16, 18, 20, 24, 32, 36, 64, 90, 360]
+
+def _compute_cos_sin(fract)->Tuple[Fraction, Fraction]:
+    turn = radians(360*fract)
+    return (Fraction(int(TRIG_DENOMINATOR*cos(turn)), TRIG_DENOMINATOR), Fraction(int(TRIG_DENOMINATOR*sin(turn)), TRIG_DENOMINATOR))
+
+class TrigTable:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.fixed = {}
+        self.recent = OrderedDict()
+        self.fixed_hits = 0
+        self.recent_hits = 0
+        self.misses = 0
+
+    def preload(self, angles: List[Fraction]):
+        for angle in angles:
+            if angle not in self.fixed:
+                self.fixed[angle] = _compute_cos_sin(angle)
+        return self
+
+    def preload_common_angles(self):
+        return self.preload([Fraction(k, den) for den in COMMON_ANGLE_DENOMINATORS for k in range(-den, den + 1)])
+
+    def cos_sin(self, fract)->Tuple[Fraction, Fraction]:
+        found = self.fixed.get(fract)
+        if found is not None:
+            self.fixed_hits += 1
+            return found
+        found = self.recent.get(fract)
+        if found is not None:
+            self.recent_hits += 1
+            self.recent.move_to_end(fract)
+            return found
+        self.misses += 1
+        found = _compute_cos_sin(fract)
+        self.recent[fract] = found
+        if len(self.recent) > self.maxsize:
+            self.recent.popitem(last = False)
+        return found
+
+    def cos_sin_float(self, fract)->Tuple[float, float]:
+        cosa, sina = self.cos_sin(fract)
+        return (float(cosa), float(sina))
+
+    def cos(self, fract)->Fraction:
+        return self.cos_sin(fract)[0]
+
+    def sin(self, fract)->Fraction:
+        return self.cos_sin(fract)[1]
+
+    def reset_stats(self):
+        self.fixed_hits = 0
+        self.recent_hits = 0
+        self.misses = 0
+        return self
+
+    def clear(self):
+        self.recent = OrderedDict()
+        return self.reset_stats()
+
+    def get_stats(self)->Dict[str, int]:
+        return {
+            "fixed-hits": self.fixed_hits,
+            "recent-hits": self.recent_hits,
+            "misses": self.misses,
+            "fixed-size": len(self.fixed),
+            "recent-size": len(self.recent)
+        }
+
+    def hit_ratio(self)->float:
+        total = self.fixed_hits + self.recent_hits + self.misses
+        return 1.0 if total == 0 else (self.fixed_hits + self.recent_hits) / total
+
+TRIG_TABLE = TrigTable().preload_common_angles()
 
 def cosFract(fract):
-    numerator = int(1000*cos(radians(360*fract)))
-    return Fraction("{}/1000".format(numerator))
+    return TRIG_TABLE.cos(fract)
 
 def sinFract(fract):
-    numerator = int(1000*sin(radians(360*fract)))
-    return Fraction("{}/1000".format(numerator))
+    return TRIG_TABLE.sin(fract)
 
 def atanFract(fract):
     angle = int(degrees(atan(fract)) / 360)
     return Fraction("{}/1000".format(angle))
 
+class NumericMode(Enum):
+    EXACT = auto()
+    FIXED_GRID = auto()
+    LIMIT_DENOMINATOR = auto()
+    NOT_SUPPORTED = auto()
+
+    @classmethod
+    def from_string(cls, value: str):
+        if value == "exact":
+            return NumericMode.EXACT
+        elif value == "fixed":
+            return NumericMode.FIXED_GRID
+        elif value == "limit":
+            return NumericMode.LIMIT_DENOMINATOR
+        else:
+            return NumericMode.NOT_SUPPORTED
+
+    @classmethod
+    def to_string(cls, value):
+        if value == NumericMode.EXACT:
+            return "exact"
+        elif value == NumericMode.FIXED_GRID:
+            return "fixed"
+        elif value == NumericMode.LIMIT_DENOMINATOR:
+            return "limit"
+        else:
+            return "E"
+
+# exact: plain Fraction arithmetic
+# fixed 1000000: every transformed coordinate is rounded to a multiple of 1/1000000
+# limit 1000000: every transformed coordinate goes through limit_denominator(1000000)
+class NumericPolicy:
+    def __init__(self, mode: NumericMode = NumericMode.EXACT, denominator: int = 1000000):
+        self.mode = mode
+        self.denominator = denominator
+        self.exact = mode == NumericMode.EXACT
+
+    @classmethod
+    def from_string(cls, value: str):
+        parts = value.strip().split()
+        mode = NumericMode.from_string(parts[0])
+        if mode == NumericMode.NOT_SUPPORTED:
+            raise Exception("Numeric policy not supported: {}".format(value))
+        if mode == NumericMode.EXACT:
+            return cls(mode)
+        return cls(mode, int(parts[1]) if len(parts) > 1 else 1000000)
+
+    def to_string(self):
+        if self.exact:
+            return NumericMode.to_string(self.mode)
+        return "{} {}".format(NumericMode.to_string(self.mode), self.denominator)
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return self.to_string()
+
+    def __eq__(self, other):
+        return self.mode == other.mode and (self.exact or self.denominator == other.denominator)
+
+    def normalize(self, value)->Fraction:
+        if self.exact or isinstance(value, float):
+            return value
+        elif self.mode == NumericMode.FIXED_GRID:
+            if self.denominator % value.denominator == 0:
+                return value
+            return Fraction(round(value * self.denominator), self.denominator)
+        else:
+            return value.limit_denominator(self.denominator) if value.denominator > self.denominator else value
+
+NUMERIC_POLICY = NumericPolicy()
+
+def get_numeric_policy()->NumericPolicy:
+    return NUMERIC_POLICY
+
+def set_numeric_policy(policy: NumericPolicy)->NumericPolicy:
+    global NUMERIC_POLICY
+    previous = NUMERIC_POLICY
+    NUMERIC_POLICY = policy
+    return previous
+
+def _v2d_with_policy(x, y):
+    policy = NUMERIC_POLICY
+    if policy.exact:
+        return V2d(x, y)
+    return V2d(policy.normalize(x), policy.normalize(y))
+
 class V2d:
     def __init__(self, x: Fraction, y: Fraction):
         self.x = x
@@ -29,9 +195,8 @@ class V2d:
 
     @classmethod
     def from_amplitude_angle(cls, amplitude: Fraction, angle: Fraction):
-        x = amplitude * cosFract(angle)
-        y = amplitude * sinFract(angle)
-        return cls(x, y)
+        cosa, sina = TRIG_TABLE.cos_sin(angle)
+        return _v2d_with_policy(amplitude * cosa, amplitude * sina)
 
     def clone(self):
         return V2d(self.x, self.y)
@@ -55,13 +220,13 @@ class V2d:
         return "{} {}".format(self.x, self.y)
 
     def __add__(self, b):
-        return V2d(self.x+b.x, self.y+b.y)
+        return _v2d_with_policy(self.x+b.x, self.y+b.y)
 
     def __sub__(self, b):
-        return V2d(self.x-b.x, self.y-b.y)
+        return _v2d_with_policy(self.x-b.x, self.y-b.y)
     
     def __mul__( self, scalar: Fraction):
-        return V2d(self.x*scalar, self.y*scalar)
+        return _v2d_with_policy(self.x*scalar, self.y*scalar)
 
     def __eq__(self, other):
         return self.x == other.x and self.y == other.y
@@ -85,9 +250,10 @@ class V2d:
     def rotate(self, angle: Fraction):
         if angle == Fraction(0):
             return self
-        xnew = self.x*cosFract(angle) - self.y*sinFract(angle)
-        ynew = self.x*sinFract(angle) + self.y*cosFract(angle)
-        return V2d(xnew, ynew)
+        cosa, sina = TRIG_TABLE.cos_sin(angle)
+        xnew = self.x*cosa - self.y*sina
+        ynew = self.x*sina + self.y*cosa
+        return _v2d_with_policy(xnew, ynew)
 
     def is_inside_rect(self, xy, width: Fraction, height: Fraction):
         return self.x >= xy.x and self.x <= xy.x + width and self.y >= xy.y and self.y <= xy.y + height
@@ -118,6 +284,187 @@ class V2dRect:
         height = righttop.y - leftbottom.y
         return cls(leftbottom, width, height)
 
+    @classmethod
+    def from_points(cls, points: List[V2d]):
+        if len(points) == 0:
+            return None
+        xx = [pt.x for pt in points]
+        yy = [pt.y for pt in points]
+        return cls.from_opposite_points(V2d(min(xx), min(yy)), V2d(max(xx), max(yy)))
+
+    def get_right_top(self)->V2d:
+        return V2d(self.xy.x + self.width, self.xy.y + self.height)
+
+    def contains_point(self, pt: V2d)->bool:
+        return pt.is_inside_rect(self.xy, self.width, self.height)
+
+    def contains_rect(self, other)->bool:
+        return other.xy.x >= self.xy.x and other.xy.y >= self.xy.y and other.xy.x + other.width <= self.xy.x + self.width and other.xy.y + other.height <= self.xy.y + self.height
+
+    def intersects_rect(self, other)->bool:
+        return other.xy.x <= self.xy.x + self.width and self.xy.x <= other.xy.x + other.width and other.xy.y <= self.xy.y + self.height and self.xy.y <= other.xy.y + other.height
+
+# x' = a*x + b*y + e, y' = c*x + d*y + f
+class Affine2d:
+    def __init__(self, a: Fraction, b: Fraction, c: Fraction, d: Fraction, e: Fraction, f: Fraction):
+        self.a = a
+        self.b = b
+        self.c = c
+        self.d = d
+        self.e = e
+        self.f = f
+
+    def to_string(self):
+        return "matrix {} {} {} {} {} {}".format(self.a, self.b, self.c, self.d, self.e, self.f)
+
+    def __str__(self):
+        return self.to_string()
+
+    def __repr__(self):
+        return self.to_string()
+
+    def __eq__(self, other):
+        return (self.a, self.b, self.c, self.d, self.e, self.f) == (other.a, other.b, other.c, other.d, other.e, other.f)
+
+    @classmethod
+    def identity(cls):
+        return cls(Fraction(1), Fraction(0), Fraction(0), Fraction(1), Fraction(0), Fraction(0))
+
+    @classmethod
+    def from_rotation(cls, angle: Fraction):
+        if angle == Fraction(0):
+            return cls.identity()
+        cosa, sina = TRIG_TABLE.cos_sin(angle)
+        return cls(cosa, -sina, sina, cosa, Fraction(0), Fraction(0))
+
+    @classmethod
+    def from_scale(cls, scalefactor: Fraction):
+        return cls(scalefactor, Fraction(0), Fraction(0), scalefactor, Fraction(0), Fraction(0))
+
+    @classmethod
+    def from_translation(cls, offset: V2d):
+        return cls(Fraction(1), Fraction(0), Fraction(0), Fraction(1), offset.x, offset.y)
+
+    @classmethod
+    def from_zoom(cls, xy: V2d, width: Fraction):
+        return cls.from_translation(-xy).scale(Fraction(1) / width)
+
+    def then(self, other):
+        return Affine2d(
+            other.a*self.a + other.b*self.c, other.a*self.b + other.b*self.d,
+            other.c*self.a + other.d*self.c, other.c*self.b + other.d*self.d,
+            other.a*self.e + other.b*self.f + other.e, other.c*self.e + other.d*self.f + other.f)
+
+    def rotate(self, angle: Fraction):
+        return self if angle == Fraction(0) else self.then(Affine2d.from_rotation(angle))
+
+    def scale(self, scalefactor: Fraction):
+        return Affine2d(self.a*scalefactor, self.b*scalefactor, self.c*scalefactor, self.d*scalefactor, self.e*scalefactor, self.f*scalefactor)
+
+    def translate(self, offset: V2d):
+        return Affine2d(self.a, self.b, self.c, self.d, self.e + offset.x, self.f + offset.y)
+
+    def zoom_to(self, xy: V2d, width: Fraction):
+        return self.then(Affine2d.from_zoom(xy, width))
+
+    def to_float_tuple(self)->Tuple[float, float, float, float, float, float]:
+        return (float(self.a), float(self.b), float(self.c), float(self.d), float(self.e), float(self.f))
+
+    def apply(self, pt: V2d)->V2d:
+        if self.b == 0 and self.c == 0:
+            return _v2d_with_policy(self.a*pt.x + self.e, self.d*pt.y + self.f)
+        return _v2d_with_policy(self.a*pt.x + self.b*pt.y + self.e, self.c*pt.x + self.d*pt.y + self.f)
+
+# Float counterpart of Affine2d as a plain (a, b, c, d, e, f) tuple, for rendering only
+def float_affine_from_transform(angle: Fraction, scalefactor: Fraction, offset: V2d)->Tuple[float, float, float, float, float, float]:
+    cosa, sina = TRIG_TABLE.cos_sin_float(angle)
+    k = float(scalefactor)
+    return (k*cosa, -k*sina, k*sina, k*cosa, float(offset.x), float(offset.y))
+
+def float_affine_then(first, second)->Tuple[float, float, float, float, float, float]:
+    a, b, c, d, e, f = first
+    aa, bb, cc, dd, ee, ff = second
+    return (aa*a + bb*c, aa*b + bb*d, cc*a + dd*c, cc*b + dd*d, aa*e + bb*f + ee, cc*e + dd*f + ff)
+
+# Running statistics over points: Welford updates for the correlation,
+# exact min/max, and order statistics by selection when asked for.
+class V2dStats:
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+        self.xmin = None
+        self.xmax = None
+        self.ymin = None
+        self.ymax = None
+        self.xx = []
+        self.yy = []
+
+    def add(self, pt: V2d):
+        x, y = pt.x, pt.y
+        self.xx.append(x)
+        self.yy.append(y)
+        if self.count == 0:
+            self.xmin, self.xmax, self.ymin, self.ymax = x, x, y, y
+        else:
+            if x < self.xmin:
+                self.xmin = x
+            elif x > self.xmax:
+                self.xmax = x
+            if y < self.ymin:
+                self.ymin = y
+            elif y > self.ymax:
+                self.ymax = y
+        self.count += 1
+        fx, fy = float(x), float(y)
+        dx = fx - self.mean_x
+        self.mean_x += dx / self.count
+        dy = fy - self.mean_y
+        self.mean_y += dy / self.count
+        self.m2_x += dx * (fx - self.mean_x)
+        self.m2_y += dy * (fy - self.mean_y)
+        self.c_xy += dx * (fy - self.mean_y)
+        return self
+
+    def extend(self, points: List[V2d]):
+        for pt in points:
+            self.add(pt)
+        return self
+
+    def __len__(self):
+        return self.count
+
+    def get_correlation(self)->float:
+        if self.count < 2 or self.m2_x == 0 or self.m2_y == 0:
+            return nan
+        return self.c_xy / sqrt(self.m2_x * self.m2_y)
+
+    def get_containing_rect(self)-> V2dRect:
+        if self.count == 0:
+            raise ValueError("No points to contain")
+        return V2dRect.from_opposite_points(V2d(self.xmin, self.ymin), V2d(self.xmax, self.ymax))
+
+    def _select(self, values: List[Fraction], kths: List[int])->List[Fraction]:
+        order = argpartition(array([float(v) for v in values], dtype=float64), kths)
+        return [values[order[k]] for k in kths]
+
+    def get_order_statistics(self, kths: List[int])->Tuple[List[Fraction], List[Fraction]]:
+        return (self._select(self.xx, kths), self._select(self.yy, kths))
+
+    def get_quantile(self, q: Fraction)->V2d:
+        k = min(int(q * self.count), self.count - 1)
+        xx, yy = self.get_order_statistics([k])
+        return V2d(xx[0], yy[0])
+
+    def get_median_range(self, n: int)->V2d:
+        idx = self.count // n
+        upper = (self.count - idx) % self.count
+        xx, yy = self.get_order_statistics([idx, upper])
+        return V2d(xx[1] - xx[0], yy[1] - yy[0])
+
 class V2dList:
     
     def __init__(self, values: List[V2d] ):
@@ -220,24 +567,201 @@ class V2dList:
         cloned.reverse()
         return V2dList(self.values.copy()+cloned)
 
+    def get_stats(self)->V2dStats:
+        return V2dStats().extend(self.values)
+
     def get_correlation(self):
-        xx = [int(v.x*1000000) for v in self.values]
-        yy = [int(v.y*1000000) for v in self.values] 
-        r = corrcoef(xx, yy)
-        return r[0, 1]
+        return self.get_stats().get_correlation()
     
     def get_median_range(self, n: int)->V2d:
-        idx = len(self.values) // n
-        xx: List[Fraction] = sorted([v.x for v in self.values])
-        yy: List[Fraction] = sorted([v.y for v in self.values])
-        width = xx[-idx] - xx[idx]
-        height = yy[-idx] - yy[idx]
-        return V2d(width, height)
+        return self.get_stats().get_median_range(n)
 
     def get_containing_rect(self)-> V2dRect:
-        xx: List[Fraction] = sorted([v.x for v in self.values])
-        yy: List[Fraction] = sorted([v.y for v in self.values])
-        return V2dRect.from_opposite_points(V2d(xx[0], yy[0]), V2d(xx[-1], yy[-1]))
+        return self.get_stats().get_containing_rect()
+
+INT64_SAFE_OPERAND = 2**31
+
+def _reduce_fractions(num, den):
+    divisor = gcd(num, den)
+    divisor = where(divisor == 0, 1, divisor)
+    sign = where(den < 0, -1, 1)
+    return num // divisor * sign, den // divisor * sign
+
+def _exact_dtype(*arrays):
+    # large operands would overflow int64, so they fall back to python integers (exact fractions)
+    for arr in arrays:
+        if len(arr) > 0 and abs(arr).max() >= INT64_SAFE_OPERAND:
+            return object
+    return int64
+
+# Structure of arrays alternative to V2dList:
+# in exact mode, x and y are the rows of int64 numerator and denominator arrays (shape 2 x n),
+# in float mode, den is None and num holds the float64 values.
+class V2dArrayList:
+    def __init__(self, num, den = None):
+        self.num = num
+        self.den = den
+
+    @classmethod
+    def from_v2d_list(cls, v2dlist: V2dList, exact = True):
+        values = v2dlist.values if isinstance(v2dlist, V2dList) else v2dlist
+        if not exact:
+            return cls(array([[float(v.x) for v in values], [float(v.y) for v in values]], dtype=float64).reshape(2, len(values)))
+        num = array([[v.x.numerator for v in values], [v.y.numerator for v in values]], dtype=object).reshape(2, len(values))
+        den = array([[v.x.denominator for v in values], [v.y.denominator for v in values]], dtype=object).reshape(2, len(values))
+        dtype = _exact_dtype(num.ravel(), den.ravel())
+        return cls(num.astype(dtype), den.astype(dtype))
+
+    @classmethod
+    def from_dalmatian_string(cls, somestr: str, sep=" ", exact = True):
+        return cls.from_v2d_list(V2dList.from_dalmatian_string(somestr, sep), exact)
+
+    @classmethod
+    def from_dalmatian_list(cls, listOfV2d: List[str], exact = True):
+        return cls.from_v2d_list(V2dList.from_dalmatian_list(listOfV2d), exact)
+
+    def is_exact(self)->bool:
+        return self.den is not None
+
+    def to_float_mode(self):
+        return V2dArrayList(self.to_float_array()) if self.is_exact() else self
+
+    def to_float_array(self):
+        return (self.num / self.den).astype(float64) if self.is_exact() else self.num
+
+    def to_v2d_list(self)->V2dList:
+        return V2dList([self[i] for i in range(len(self))])
+
+    def __str__(self):
+        return str(self.to_v2d_list())
+
+    def __repr__(self):
+        return str(self.to_v2d_list())
+
+    def length(self):
+        return self.num.shape[1]
+
+    def __len__(self):
+        return self.num.shape[1]
+
+    def __eq__(self, other):
+        if self.is_exact() != other.is_exact() or len(self) != len(other):
+            return False
+        if self.is_exact():
+            return bool((self.num == other.num).all() and (self.den == other.den).all())
+        return bool((self.num == other.num).all())
+
+    def _point(self, i: int)->V2d:
+        if self.is_exact():
+            return V2d(Fraction(int(self.num[0, i]), int(self.den[0, i])), Fraction(int(self.num[1, i]), int(self.den[1, i])))
+        return V2d(float(self.num[0, i]), float(self.num[1, i]))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._point(i) for i in range(len(self))[index]]
+        return self._point(index)
+
+    def _with(self, num, den):
+        return V2dArrayList(num, den if self.is_exact() else None)
+
+    def clone(self):
+        return self._with(self.num.copy(), self.den.copy() if self.is_exact() else None)
+
+    def ljust(self, length: int):
+        missing = length - len(self)
+        if missing <= 0:
+            return self
+        num = concatenate([self.num, zeros((2, missing), dtype=self.num.dtype)], axis=1)
+        den = concatenate([self.den, ones((2, missing), dtype=int64)], axis=1) if self.is_exact() else None
+        return self._with(num, den)
+
+    def __neg__(self):
+        return self._with(-self.num, self.den)
+
+    def __add__(self, b):
+        maxlength = max(len(self), len(b))
+        aa = self.ljust(maxlength)
+        bb = b.ljust(maxlength)
+        if not self.is_exact() or not b.is_exact():
+            # mixing an exact list with a float list gives a float list
+            return V2dArrayList(aa.to_float_array() + bb.to_float_array())
+        dtype = _exact_dtype(aa.num.ravel(), aa.den.ravel(), bb.num.ravel(), bb.den.ravel())
+        anum, aden, bnum, bden = [arr.astype(dtype) for arr in (aa.num, aa.den, bb.num, bb.den)]
+        return V2dArrayList(*_reduce_fractions(anum*bden + bnum*aden, aden*bden))
+
+    def __sub__(self, b):
+        return self + (-b)
+
+    def __mul__(self, scalar: Fraction):
+        if not self.is_exact():
+            return V2dArrayList(self.num * float(scalar))
+        scalar = Fraction(scalar)
+        dtype = _exact_dtype(self.num.ravel(), self.den.ravel(), array([scalar.numerator, scalar.denominator], dtype=object))
+        num, den = self.num.astype(dtype), self.den.astype(dtype)
+        return V2dArrayList(*_reduce_fractions(num*scalar.numerator, den*scalar.denominator))
+
+    def neg_x(self):
+        return self._with(self.num * array([[-1], [1]]), self.den)
+
+    def neg_y(self):
+        return self._with(self.num * array([[1], [-1]]), self.den)
+
+    def select(self, index: slice):
+        return self._with(self.num[:, index].copy(), self.den[:, index].copy() if self.is_exact() else None)
+
+    def reverse(self):
+        return self._with(self.num[:, ::-1].copy(), self.den[:, ::-1].copy() if self.is_exact() else None)
+
+    def extend(self, other):
+        num = concatenate([self.num, other.num], axis=1)
+        den = concatenate([self.den, other.den], axis=1) if self.is_exact() else None
+        return self._with(num, den)
+
+    def mirror(self):
+        return self.extend(self.reverse())
+
+    def to_dalmatian_list(self):
+        return self.to_v2d_list().to_dalmatian_list()
+
+    def to_dalmatian_string(self, sep=" "):
+        return sep.join(self.to_dalmatian_list())
+
+    def to_cartesian_string(self, dpu: float, sep=""):
+        xy = self.to_float_array() * dpu
+        return sep.join(["({:.3f},{:.3f})".format(x, y) for x, y in zip(xy[0], xy[1])])
+
+    def to_svg_string(self, dpu: float, ypixoffset:float, sep=" "):
+        xy = self.to_float_array() * dpu
+        return sep.join(["{:.3f} {:.3f}".format(x, ypixoffset - y) for x, y in zip(xy[0], xy[1])])
+
+    def get_correlation(self):
+        xy = self.to_float_array()
+        r = corrcoef(xy[0], xy[1])
+        return r[0, 1]
+
+    def _exact_at(self, axis: int, i: int):
+        return Fraction(int(self.num[axis, i]), int(self.den[axis, i])) if self.is_exact() else float(self.num[axis, i])
+
+    def _order_statistics(self, axis: int, kths: List[int]):
+        order = argpartition(self.to_float_array()[axis], kths)
+        return [self._exact_at(axis, order[k]) for k in kths]
+
+    def get_median_range(self, n: int)->V2d:
+        length = len(self)
+        idx = length // n
+        kths = sorted(set([idx, (length-idx) % length]))
+        xx = dict(zip(kths, self._order_statistics(0, kths)))
+        yy = dict(zip(kths, self._order_statistics(1, kths)))
+        upper = (length-idx) % length
+        return V2d(xx[upper] - xx[idx], yy[upper] - yy[idx])
+
+    def get_containing_rect(self)-> V2dRect:
+        if len(self) == 0:
+            raise ValueError("No points to contain")
+        xy = self.to_float_array()
+        xmin, xmax = self._exact_at(0, xy[0].argmin()), self._exact_at(0, xy[0].argmax())
+        ymin, ymax = self._exact_at(1, xy[1].argmin()), self._exact_at(1, xy[1].argmax())
+        return V2dRect.from_opposite_points(V2d(xmin, ymin), V2d(xmax, ymax))
 
 
 class FractionList:
@@ -433,6 +957,23 @@ class VSegment:
         else:
             return VSegment()
 
+    @classmethod
+    def from_points(cls, action: SegmentShape, points: List[V2d]):
+        if action == SegmentShape.CLOSE_PATH and len(points) == 0:
+            return VSegment.from_close()
+        elif SegmentShape.count_of_points(action) != len(points) or len(points) == 0:
+            return VSegment()
+        elif len(points) == 1:
+            return cls(action, points[0])
+        elif len(points) == 2:
+            return cls(action, points[1], points[0])
+        else:
+            return cls(action, points[2], points[0], points[1])
+
+    def get_points(self)->List[V2d]:
+        # same order as the dalmatian string
+        return [pt for pt in [self.pt1, self.pt2, self.pt] if pt is not None]
+
     def to_svg_string(self, dpu: float, ypixoffset: float):
         action_str = SegmentShape.to_string(self.action)
         if self.action == SegmentShape.CLOSE_PATH:
@@ -484,12 +1025,68 @@ class VSegment:
             pt2 = pt2 * scalefactor
         return VSegment(action = self.action, pt = pt, pt1 = pt1, pt2 = pt2 )
 
+    def transform(self, affine: Affine2d):
+        pt = self.pt
+        pt1 = self.pt1
+        pt2 = self.pt2
+        if pt is not None:
+            pt = affine.apply(pt)
+        if pt1 is not None:
+            pt1 = affine.apply(pt1)
+        if pt2 is not None:
+            pt2 = affine.apply(pt2)
+        return VSegment(action = self.action, pt = pt, pt1 = pt1, pt2 = pt2 )
+
     def is_mostly_inside_rect(self, xy: V2d, width: Fraction, height: Fraction):
         return self.pt.is_inside_rect(xy, width, height) if self.pt is not None else True
 
+PATTERN_DALMATIAN_PATH_TOKEN = re.compile(r"([A-Za-z])|(,)|([-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:/\d+)?)")
+
+@lru_cache(maxsize = 65536)
+def parse_fraction_token(token: str)->Fraction:
+    if "/" in token and not "." in token:
+        numerator, denominator = token.split("/")
+        return Fraction(int(numerator), int(denominator))
+    return Fraction(token)
+
+def _to_segment(action: SegmentShape, fractions: List[Fraction])->VSegment:
+    if action is None:
+        return VSegment()
+    if action == SegmentShape.CLOSE_PATH:
+        return VSegment.from_close() if len(fractions) == 0 else VSegment()
+    count = SegmentShape.count_of_points(action)
+    if count == 0 or len(fractions) != 2*count:
+        return VSegment()
+    points = [V2d(fractions[2*i], fractions[2*i+1]) for i in range(count)]
+    if count == 1:
+        return VSegment(action, points[0])
+    elif count == 2:
+        return VSegment(action, points[1], points[0])
+    else:
+        return VSegment(action, points[2], points[0], points[1])
+
+def tokenize_dalmatian_path(dstr: str)->List[VSegment]:
+    segments = []
+    action = None
+    fractions = []
+    for letter, comma, number in PATTERN_DALMATIAN_PATH_TOKEN.findall(dstr):
+        if number:
+            fractions.append(parse_fraction_token(number))
+        elif letter:
+            action = SegmentShape.from_string(letter)
+        else:
+            segments.append(_to_segment(action, fractions))
+            action = None
+            fractions = []
+    if action is not None or len(fractions) > 0:
+        segments.append(_to_segment(action, fractions))
+    return segments
+
 class VPath:
     def __init__(self, segments: List[VSegment]):
         self.segments = segments
+        self._core_bounding_box = None
+        self._all_bounding_box = None
 
     def __str__(self):
         return str(self.segments)
@@ -512,10 +1109,26 @@ class VPath:
     
     @classmethod
     def from_dalmatian_string(cls, dstr):
+        return cls(tokenize_dalmatian_path(dstr))
+
+    @classmethod
+    def from_dalmatian_string_by_split(cls, dstr):
         parts =  dstr.replace("[","").replace("]", "").strip().split(",")
         segments = [VSegment.from_dalmatian_string(segment) for segment in parts]
         return cls(segments)
 
+    @classmethod
+    def from_dalmatian_string_list(cls, dstrs: List[str]):
+        # the only gain over from_dalmatian_string is that a repeated string is tokenized once,
+        # distinct strings cost the same or slightly more
+        parsed = {}
+        results = []
+        for dstr in dstrs:
+            if dstr not in parsed:
+                parsed[dstr] = tokenize_dalmatian_path(dstr)
+            results.append(cls(parsed[dstr].copy()))
+        return results
+
     def core_points(self):
         return [segment.pt for segment in self.segments if SegmentShape.count_of_points(segment.action)>0]
 
@@ -554,5 +1167,130 @@ class VPath:
         newsegments = [segment.scale(scalefactor) for segment in self.segments]
         return VPath(newsegments)
 
+    def transform(self, affine: Affine2d):
+        newsegments = [segment.transform(affine) for segment in self.segments]
+        return VPath(newsegments)
+
+    def all_points(self):
+        return [pt for segment in self.segments for pt in [segment.pt, segment.pt1, segment.pt2] if pt is not None]
+
+    def get_bounding_box(self, control_points = False)->V2dRect:
+        if control_points:
+            if self._all_bounding_box is None:
+                self._all_bounding_box = V2dRect.from_points(self.all_points())
+            return self._all_bounding_box
+        if self._core_bounding_box is None:
+            self._core_bounding_box = V2dRect.from_points(self.core_points())
+        return self._core_bounding_box
+
+    def is_inside_rect(self, rect: V2dRect)->bool:
+        if len(self.segments) == 0:
+            return False
+        bbox = self.get_bounding_box()
+        # the box is tight so any core point beyond the rect edge makes it straddle
+        return bbox is None or rect.contains_rect(bbox)
+
+    def intersects_rect(self, rect: V2dRect, control_points = False)->bool:
+        bbox = self.get_bounding_box(control_points)
+        if bbox is None or not rect.intersects_rect(bbox):
+            return False
+        if rect.contains_rect(bbox):
+            return True
+        points = self.all_points() if control_points else self.core_points()
+        return any(rect.contains_point(pt) for pt in points)
+
     def is_mostly_inside_rect(self, xy: V2d, width: Fraction, height: Fraction):
-        return set([ segment.is_mostly_inside_rect(xy, width, height) for segment in self.segments]) == set([True])
\ No newline at end of file
+        return self.is_inside_rect(V2dRect(xy, width, height))
+
+    def to_float_array(self):
+        return VPathArray.from_vpath(self)
+
+FLOAT_RECT_TOLERANCE = 1e-9
+
+def _svg_points_of(segment: VSegment)->List[V2d]:
+    if segment.action in [SegmentShape.MOVE_TO, SegmentShape.LINE_TO, SegmentShape.FLUID_BEZIER] and segment.pt is not None:
+        return [segment.pt]
+    elif segment.action in [SegmentShape.SMOOTH_BEZIER, SegmentShape.QUADRATIC_BEZIER] and segment.pt is not None:
+        return [segment.pt1, segment.pt]
+    elif segment.action == SegmentShape.CUBIC_BEZIER and segment.pt is not None:
+        return [segment.pt1, segment.pt2, segment.pt]
+    else:
+        return []
+
+# Float64 view of a VPath for rendering: the points are stored in svg order
+# and the svg path is written from a format template built once per path.
+class VPathArray:
+    def __init__(self, points, template: str, core_index):
+        self.points = points
+        self.template = template
+        self.core_index = core_index
+
+    @classmethod
+    def from_vpath(cls, vpath: VPath):
+        points = []
+        core_index = []
+        parts = []
+        for segment in vpath.segments:
+            svgpoints = _svg_points_of(segment)
+            action_str = SegmentShape.to_string(segment.action) if len(svgpoints) > 0 or segment.action == SegmentShape.CLOSE_PATH else "E"
+            parts.append(" ".join([action_str] + ["{:.3f} {:.3f}" for _ in svgpoints]))
+            points += svgpoints
+            if len(svgpoints) > 0:
+                core_index.append(len(points) - 1)
+        xy = array([[float(pt.x) for pt in points], [float(pt.y) for pt in points]], dtype=float64).reshape(2, len(points))
+        return cls(xy, " ".join(parts), array(core_index, dtype=int64))
+
+    def __len__(self):
+        return self.points.shape[1]
+
+    def transform(self, matrix: Tuple[float, float, float, float, float, float]):
+        a, b, c, d, e, f = matrix
+        x, y = self.points
+        return VPathArray(array([a*x + b*y + e, c*x + d*y + f]), self.template, self.core_index)
+
+    def transform_batch(self, matrices):
+        # matrices is a (N, 6) array of (a, b, c, d, e, f); the result is (N, 2, M)
+        a, b, c, d, e, f = [matrices[:, i:i+1] for i in range(6)]
+        x, y = self.points[0][None, :], self.points[1][None, :]
+        return stack([a*x + b*y + e, c*x + d*y + f], axis=1)
+
+    def __eq__(self, other):
+        return isinstance(other, VPathArray) and self.template == other.template and self.points.shape == other.points.shape and bool((self.points == other.points).all())
+
+    def core_points(self):
+        return self.points[:, self.core_index]
+
+    def get_float_bounding_box(self, control_points = False)->Tuple[float, float, float, float]:
+        points = self.points if control_points else self.core_points()
+        if points.shape[1] == 0:
+            return None
+        return (points[0].min(), points[1].min(), points[0].max(), points[1].max())
+
+    def is_inside_rect(self, rect: V2dRect)->bool:
+        if len(self.core_index) == 0:
+            return len(self.template) > 0
+        xmin, ymin, xmax, ymax = self.get_float_bounding_box()
+        left, bottom = float(rect.xy.x) - FLOAT_RECT_TOLERANCE, float(rect.xy.y) - FLOAT_RECT_TOLERANCE
+        right, top = float(rect.xy.x + rect.width) + FLOAT_RECT_TOLERANCE, float(rect.xy.y + rect.height) + FLOAT_RECT_TOLERANCE
+        return xmin >= left and ymin >= bottom and xmax <= right and ymax <= top
+
+    def intersects_rect(self, rect: V2dRect, control_points = False)->bool:
+        bbox = self.get_float_bounding_box(control_points)
+        if bbox is None:
+            return False
+        xmin, ymin, xmax, ymax = bbox
+        left, bottom = float(rect.xy.x) - FLOAT_RECT_TOLERANCE, float(rect.xy.y) - FLOAT_RECT_TOLERANCE
+        right, top = float(rect.xy.x + rect.width) + FLOAT_RECT_TOLERANCE, float(rect.xy.y + rect.height) + FLOAT_RECT_TOLERANCE
+        if xmax < left or xmin > right or ymax < bottom or ymin > top:
+            return False
+        if xmin >= left and ymin >= bottom and xmax <= right and ymax <= top:
+            return True
+        x, y = self.points if control_points else self.core_points()
+        return bool(((x >= left) & (x <= right) & (y >= bottom) & (y <= top)).any())
+
+    def to_float_string(self):
+        return self.template.format(*self.points.T.ravel().tolist())
+
+    def to_svg_string(self, dpu: float, ypixoffset: float):
+        xy = array([self.points[0] * dpu, ypixoffset - self.points[1] * dpu])
+        return self.template.format(*xy.T.ravel().tolist())
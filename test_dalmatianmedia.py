@@ -1,7 +1,9 @@
+import io
 import unittest
+import xml.etree.ElementTree as ET
 from fractions import Fraction
-from fracgeometry import V2d, V2dList, VSegment, VPath, FractionList
-from dalmatianmedia import DlmtView, DlmtTagDescription, DlmtBrush, DlmtBrushstroke, DlmtCoordinateSystem, DlmtBrushCoordinateSystem, DlmtHeaders, DalmatianMedia, SvgRenderingConfig
+from fracgeometry import V2d, V2dRect, V2dList, VSegment, VPath, FractionList, Affine2d
+from dalmatianmedia import DlmtView, DlmtTagDescription, DlmtBrush, DlmtBrushstroke, DlmtCoordinateSystem, DlmtBrushCoordinateSystem, DlmtHeaders, DalmatianMedia, DlmtReader, DlmtBinary, PageBrushstroke, FloatPageBrushstroke, SvgRenderingConfig, SvgSymbolMode, SvgFragmentCache
 
 pt0 = V2d.from_string("0/1 0/1")
 ptA = V2d.from_string("1/4 1/3")
@@ -85,6 +87,7 @@ class TestSvgRenderingConfig(unittest.TestCase):
         self.assertEqual(renderConfig.brush_width, Fraction(20.0))
 
 homeBrush = "brush i:1 ext-id brushes:home path [ M -1/3 1/3,L 0 0, L 1/3 1/3,L 1/3 -1/3,L -1/3 -1/3 ]"
+homeVPath = DlmtBrush.from_string(homeBrush).vpath
 
 class TestDalmatianMedia(unittest.TestCase):
 
@@ -121,6 +124,38 @@ class TestDalmatianMedia(unittest.TestCase):
         self.assertEqual(media.get_used_short_prefixes(), set(["geospecies"]))
         self.assertEqual(media.check_references(), [])
     
+    def test_from_file(self):
+        media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/100")))
+        media.add_view_string("view i:1 lang en-gb xy 0 0 width 1/1 height 1/1 flags OC tags all but [ ]-> everything")
+        media.add_tag_description_string("tag i:1 lang en-gb same-as [] -> default tag")
+        media.add_brush_string(homeBrush)
+        for i in range(0, 90, 10):
+            media.add_brushstroke_string("brushstroke i:1 xy {}/100 10/100 scale 1 angle 0/1 tags [ i:1 ]".format(i))
+        self.assertEqual(DalmatianMedia.from_file(io.StringIO(str(media))), media)
+        self.assertEqual(DalmatianMedia.from_file(io.BytesIO(str(media).encode("utf-8"))), media)
+        reader = DlmtReader.from_file(io.StringIO(str(media)))
+        self.assertEqual(len(reader.read_head().brushstrokes), 0)
+        brushstrokes = reader.iter_brushstrokes()
+        self.assertEqual(next(brushstrokes), media.brushstrokes[0])
+        self.assertEqual(len(list(brushstrokes)), 8)
+
+    def test_binary_file(self):
+        media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/100")))
+        media.add_view_string("view i:1 lang en-gb xy 0 0 width 1/1 height 1/1 flags OC tags all but [ ]-> everything")
+        media.add_tag_description_string("tag i:1 lang en-gb same-as [] -> default tag")
+        media.add_tag_description_string("tag i:2 lang en-gb same-as [] -> other tag")
+        media.add_brush_string(homeBrush)
+        media.add_brush_string("brush i:2 ext-id brushes:abc4 path [ M -1/3 1/3,C 1/5 1/6 1/7 1/8 1/9 1/10,S 1/5 1/6 1/7 1/8,Z ]")
+        for i in range(0, 90, 10):
+            media.add_brushstroke_string("brushstroke i:{} xy {}/100 -10/100 scale {}/7 angle -{}/90 tags [ i:2, i:1 ]".format(1 + i % 20 // 10, i, i + 1, i))
+        media.add_brushstroke_string("brushstroke i:1 xy 1 2 scale 1 angle 0 tags [ i:1 ]")
+        content = io.BytesIO()
+        media.to_binary_file(content)
+        binary = DlmtBinary.from_buffer(content.getvalue())
+        self.assertEqual(binary.to_media(), media)
+        self.assertEqual(binary.arrays["stroke-values"].shape, (10, 8))
+        self.assertEqual(binary.arrays["stroke-tag-mask"].tolist(), [3] * 9 + [1])
+
     def test_to_page_brushstroke_list(self):
         media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/100")))
         media.add_view_string("view i:1 lang en-gb xy 0 0 width 1/1 height 1/1 flags OC tags all but [ ]-> everything")
@@ -201,6 +236,194 @@ class TestDalmatianMedia(unittest.TestCase):
         self.assertEqual(len(media.page_brushstroke_list_for_view(viewallbut2)), 2)
         self.assertEqual(len(media.page_brushstroke_list_for_view(viewnonebut3)), 1)
 
+    def test_float_page_brushstroke_list_for_view(self):
+        theview = DlmtView.from_string("view i:2 lang en-gb xy 20/100 20/100 width 1/2 height 1/2 flags O tags all but [ ] -> everything")
+        media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/100")))
+        media.add_view(theview)
+        media.add_tag_description_string("tag i:1 lang en-gb same-as [] -> default tag")
+        media.add_brush_string(homeBrush)
+        for i in range(0, 90, 10):
+            media.add_brushstroke_string("brushstroke i:1 xy {}/100 30/100 scale {}/10 angle {}/90 tags [ i:1 ]".format(i, i + 1, i))
+        exact = media.page_brushstroke_list_for_view(theview)
+        floats = media.float_page_brushstroke_list_for_view(theview)
+        self.assertEqual(len(floats), len(exact))
+        for exactpbs, floatpbs in zip(exact, floats):
+            exactnumbers = [float(v) for v in exactpbs.vpath.to_svg_string(400, 400).split() if v not in "MLZ"]
+            floatnumbers = [float(v) for v in floatpbs.vpath.to_svg_string(400, 400).split() if v not in "MLZ"]
+            for a, b in zip(exactnumbers, floatnumbers):
+                self.assertAlmostEqual(a, b, delta = 0.0011)
+        renderConfig = media.create_page_pixel_coordinate("i:2", 100).set_float_mode(True)
+        self.assertEqual(len(media.page_brushstroke_list_for_rendering(renderConfig)), len(exact))
+
+    def test_page_geometry_cache(self):
+        media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/100")))
+        media.add_brush_string(homeBrush)
+        for i in range(0, 90, 10):
+            media.add_brushstroke_string("brushstroke i:1 xy {}/100 30/100 scale {}/10 angle {}/4 tags [ i:1 ]".format(i, 1 + i % 20 // 10, i % 30 // 10))
+        expected = [PageBrushstroke(homeVPath.transform(media.get_page_transform(bs)), set(bs.tags)) for bs in media.brushstrokes]
+        self.assertEqual(media.to_page_brushstroke_list(), expected)
+        self.assertEqual(media.get_page_geometry_stats(), { "hits": 3, "misses": 6, "size": 6, "maxsize": 1024 })
+        self.assertEqual(media.to_page_brushstroke_list(), expected)
+        self.assertEqual(media.get_page_geometry_stats()["hits"], 12)
+        media.set_page_geometry_cache_size(2)
+        self.assertEqual(media.get_page_geometry_stats()["size"], 2)
+        self.assertEqual(media.to_page_brushstroke_list(), expected)
+        media.add_brush_string(homeBrush)
+        self.assertEqual(media.get_page_geometry_stats()["size"], 0)
+
+    def test_spatial_index(self):
+        theview = DlmtView.from_string("view i:2 lang en-gb xy 20/100 20/100 width 1/2 height 1/2 flags O tags all but [ ] -> everything")
+        media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/10")))
+        media.add_brush_string(homeBrush)
+        for i in range(0, 100, 5):
+            media.add_brushstroke_string("brushstroke i:1 xy {}/100 {}/100 scale 1/2 angle {}/7 tags [ i:1 ]".format(i, (i * 37) % 100, i))
+        zoom = Affine2d.from_zoom(theview.xy, theview.width)
+        zoomed_rect = V2dRect(V2d(Fraction(0), Fraction(0)), Fraction(1), Fraction(1))
+        expected = [i for i, bs in enumerate(media.brushstrokes) if media.to_page_brushstroke_list()[i].transform(zoom).is_inside_rect(zoomed_rect)]
+        candidates = media.candidate_indices_for_view(theview)
+        self.assertTrue(set(expected).issubset(candidates))
+        self.assertLess(len(candidates), len(media.brushstrokes))
+        self.assertEqual(media.page_brushstroke_list_for_view(theview), [media.to_page_brushstroke_list()[i].transform(zoom) for i in expected])
+        media.add_brushstroke_string("brushstroke i:1 xy 1/2 1/2 scale 1/2 angle 0 tags [ i:1 ]")
+        self.assertEqual(len(media.get_spatial_index()), 21)
+        self.assertEqual(media.candidate_indices_for_view(theview)[-1], 20)
+        # a brush without points has no extent, so its brushstrokes stay candidates like in the inside test
+        media.add_brush_string("brush i:2 ext-id brushes:empty path [ Z ]")
+        media.add_brushstroke_string("brushstroke i:2 xy 3 3 scale 1 angle 0 tags [ i:1 ]")
+        self.assertEqual(media.candidate_indices_for_view(theview)[-1], 21)
+        self.assertEqual(len(media.page_brushstroke_list_for_view(theview)), len(expected) + 2)
+        self.assertEqual(len(media.float_page_brushstroke_list_for_view(theview)), len(expected) + 2)
+
+    def test_tag_index(self):
+        media = DalmatianMedia(DlmtHeaders())
+        media.add_tag_description_string("tag i:1 lang en-gb same-as [] -> head")
+        media.add_tag_description_string("tag i:2 lang en-gb same-as [] -> body")
+        media.add_brush_string(homeBrush)
+        for tags in ["i:1", "i:2", "i:1, i:2", "i:3", ""]:
+            media.add_brushstroke_string("brushstroke i:1 xy 1/2 1/2 scale 1 angle 0 tags [ {} ]".format(tags))
+        self.assertEqual(media.get_tag_index().get_tag_ids(), ["i:1", "i:2", "i:3"])
+        self.assertEqual(media.get_stroke_tag_masks(), [1, 2, 3, 4, 0])
+        common = "view i:1 lang en-gb xy 0 0 width 1 height 1 flags C "
+        for tags in ["all but [ ]", "all but [ i:1 ]", "all but [ i:2, i:3 ]", "none but [ i:1 ]", "none but [ i:2, i:4 ]", "none but [ ]"]:
+            view = DlmtView.from_string(common + "tags {} -> test".format(tags))
+            expected = [i for i, bs in enumerate(media.brushstrokes) if view.accept_tags(bs.get_tags_set())]
+            self.assertEqual(media.tag_indices_for_view(view), expected)
+            self.assertIs(media.tag_indices_for_view(view), media.tag_indices_for_view(view))
+        media.add_brushstroke_string("brushstroke i:1 xy 1/2 1/2 scale 1 angle 0 tags [ i:1 ]")
+        self.assertEqual(media.tag_indices_for_view(DlmtView.from_string(common + "tags none but [ i:1 ] -> test")), [0, 2, 5])
+
+    def test_to_page_brushstroke_arrays(self):
+        media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/100")))
+        media.add_tag_description_string("tag i:1 lang en-gb same-as [] -> default tag")
+        media.add_brush_string(homeBrush)
+        media.add_brush_string("brush i:2 ext-id brushes:abc4 path [ M -1/3 1/3,L 2/3 0/1,C 1/5 1/6 1/7 1/8 1/9 1/10,Z ]")
+        for i in range(0, 90, 10):
+            media.add_brushstroke_string("brushstroke i:{} xy {}/100 -30/100 scale {}/10 angle {}/90 tags [ i:1 ]".format(1 + i % 20 // 10, i, i + 1, i))
+        exact = media.to_page_brushstroke_list()
+        floats = media.to_page_brushstroke_arrays()
+        self.assertEqual(len(floats), len(exact))
+        for exactpbs, floatpbs in zip(exact, floats):
+            self.assertEqual(floatpbs.tags, exactpbs.tags)
+            exactpoints = [(float(pt.x), float(pt.y)) for seg in exactpbs.vpath.segments for pt in [seg.pt1, seg.pt2, seg.pt] if pt is not None]
+            floatpoints = floatpbs.vpath.points.T.tolist()
+            self.assertEqual(len(floatpoints), len(exactpoints))
+            for (ex, ey), (fx, fy) in zip(exactpoints, floatpoints):
+                self.assertAlmostEqual(ex, fx, delta = 1e-9)
+                self.assertAlmostEqual(ey, fy, delta = 1e-9)
+        for exactpbs, floatpbs in zip(exact, floats):
+            self.assertIsInstance(floatpbs, FloatPageBrushstroke)
+            self.assertTrue(repr(floatpbs).startswith("fpbs path M "))
+            self.assertEqual(floatpbs, floatpbs.transform(Affine2d.identity()))
+            self.assertNotEqual(floatpbs, exactpbs)
+            exactbox = exactpbs.get_bounding_box(True)
+            for a, b in zip(floatpbs.get_float_bounding_box(True), [exactbox.xy.x, exactbox.xy.y, exactbox.xy.x + exactbox.width, exactbox.xy.y + exactbox.height]):
+                self.assertAlmostEqual(a, float(b), delta = 1e-9)
+            zoomed, exactzoomed = floatpbs.zoom_to(V2d.from_string("0 -1/2"), Fraction(1, 2)), exactpbs.zoom_to(V2d.from_string("0 -1/2"), Fraction(1, 2))
+            for rect in [V2dRect.from_opposite_points(V2d.from_string("0 0"), V2d.from_string("1 1")), V2dRect.from_opposite_points(V2d.from_string("1/2 1/2"), V2d.from_string("3/5 3/5"))]:
+                self.assertEqual(zoomed.is_inside_rect(rect), exactzoomed.is_inside_rect(rect))
+                self.assertEqual(zoomed.intersects_rect(rect), exactzoomed.intersects_rect(rect))
+        batches = media.to_page_brushstroke_batches()
+        self.assertEqual([batch.brushid for batch in batches], ["i:1", "i:2"])
+        self.assertEqual(sum([len(batch) for batch in batches]), 9)
+
+    def test_render_views(self):
+        with open("examples/one.dlmt", 'r') as dlmtfile:
+            media = DalmatianMedia.from_file(dlmtfile)
+        media.add_view_string("view i:3 lang en-gb xy 1/10 1/10 width 1/2 height 1/4 flags C tags none but [ i:1 ] -> crop")
+        views = media.get_sorted_views()
+        rendered = media.render_views(views, [100, 200, 300])
+        for view, width, tree in zip(views, [100, 200, 300], rendered):
+            expected = media.to_xml_svg(media.create_page_pixel_coordinate(view.id, width))
+            self.assertEqual(ET.tostring(tree.getroot()), ET.tostring(expected.getroot()))
+        floats = media.render_views(views, [100, 200, 300], float_mode = True)
+        for tree, exact in zip(floats, rendered):
+            self.assertEqual(len(tree.getroot()), len(exact.getroot()))
+
+    def test_svg_symbols(self):
+        def numbers(d):
+            return [float(v) for v in d.split() if v not in "MLCSQTZ"]
+        def apply(transform, points):
+            values = [float(v) for v in transform.replace("(", " ").replace(")", " ").split()[1:] if v not in ["translate", "scale"]]
+            a, b, c, d, e, f = values if transform.startswith("matrix") else ([values[2], 0, 0, values[2]] if len(values) == 3 else [1, 0, 0, 1]) + values[0:2]
+            return [v for x, y in zip(points[0::2], points[1::2]) for v in (a*x + c*y + e, b*x + d*y + f)]
+        with open("examples/one.dlmt", 'r') as dlmtfile:
+            media = DalmatianMedia.from_file(dlmtfile)
+        for viewid in ["i:1", "i:2"]:
+            paths = [numbers(e.get("d")) for e in media.to_xml_svg(media.create_page_pixel_coordinate(viewid, 400)).getroot() if e.tag == "path"]
+            for mode, count in [("brush", 1), ("transform", len(paths))]:
+                root = media.to_xml_svg(media.create_page_pixel_coordinate(viewid, 400).set_symbol_mode(SvgSymbolMode.from_string(mode))).getroot()
+                symbols = { symbol.get("id"): numbers(symbol[0].get("d")) for symbol in root.iter("symbol") }
+                uses = [apply(use.get("transform"), symbols[use.get("xlink:href")[1:]]) for use in root if use.tag == "use"]
+                self.assertLessEqual(len(symbols), count)
+                self.assertEqual(len(uses), len(paths))
+                for path, use in zip(paths, uses):
+                    for expected, actual in zip(path, use):
+                        self.assertAlmostEqual(expected, actual, delta = 0.01)
+        with self.assertRaises(Exception):
+            media.create_page_pixel_coordinate("i:1", 400).set_symbol_mode(SvgSymbolMode.from_string("brushes"))
+
+    def test_write_xml_svg(self):
+        with open("examples/one.dlmt", 'r') as dlmtfile:
+            media = DalmatianMedia.from_file(dlmtfile)
+        for viewid in ["i:1", "i:2"]:
+            for float_mode, symbol_mode in [(False, "none"), (True, "none"), (False, "brush"), (True, "transform")]:
+                renderConfig = media.create_page_pixel_coordinate(viewid, 200).set_float_mode(float_mode).set_symbol_mode(SvgSymbolMode.from_string(symbol_mode))
+                expected = io.BytesIO()
+                media.to_xml_svg(renderConfig).write(expected, encoding='UTF-8')
+                streamed = io.BytesIO()
+                media.write_xml_svg(renderConfig, streamed)
+                self.assertEqual(streamed.getvalue(), expected.getvalue())
+                if symbol_mode == "none":
+                    lazily = [str(pbs.to_xml_svg(renderConfig).attrib) for pbs in media.iter_page_brushstrokes_for_rendering(renderConfig, chunk_size = 5)]
+                    self.assertEqual(lazily, [str(pbs.to_xml_svg(renderConfig).attrib) for pbs in media.page_brushstroke_list_for_rendering(renderConfig)])
+                lines = io.BytesIO()
+                media.write_xml_svg(renderConfig, lines, compatible = False)
+                declaration, content = lines.getvalue().split(b"\n", 1)
+                self.assertEqual(declaration, b"<?xml version='1.0' encoding='UTF-8'?>")
+                self.assertEqual(content.replace(b"\n", b""), expected.getvalue())
+
+    def test_svg_fragment_cache(self):
+        with open("examples/one.dlmt", 'r') as dlmtfile:
+            media = DalmatianMedia.from_file(dlmtfile)
+        fragments = SvgFragmentCache()
+        for viewid in ["i:1", "i:2"]:
+            for float_mode in [False, True]:
+                renderConfig = media.create_page_pixel_coordinate(viewid, 200).set_float_mode(float_mode)
+                expected = io.BytesIO()
+                media.set_svg_fragment_cache(None).write_xml_svg(renderConfig, expected)
+                for _ in range(2):
+                    cached = io.BytesIO()
+                    media.set_svg_fragment_cache(fragments).write_xml_svg(renderConfig, cached)
+                    self.assertEqual(cached.getvalue(), expected.getvalue())
+        self.assertEqual(fragments.hits, fragments.misses)
+        # moving one brushstroke only serializes that brushstroke again
+        renderConfig = media.create_page_pixel_coordinate("i:1", 200)
+        media.brushstrokes[0].xy = media.brushstrokes[0].xy + V2d.from_string("1/1000 0")
+        fragments.reset_stats()
+        media.to_xml_svg(renderConfig)
+        self.assertEqual(fragments.misses, 1)
+        self.assertEqual(ET.tostring(media.to_xml_svg(renderConfig).getroot()), ET.tostring(media.set_svg_fragment_cache(None).to_xml_svg(renderConfig).getroot()))
+
     def test_export_svg(self):
         headers = DlmtHeaders().set_brush_page_ratio(Fraction("1/100"))
         headers.set_id_urn("company/project/example123")
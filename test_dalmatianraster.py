@@ -0,0 +1,74 @@
+import io
+import unittest
+from fractions import Fraction
+from dalmatianmedia import DlmtHeaders, DalmatianMedia
+from PIL import Image
+from numpy import array
+from dalmatianraster import parse_svg_path, flatten_svg_path, RasterCanvas, rasterize_media, write_media_png_tiled, write_png_rows
+
+class TestSvgPath(unittest.TestCase):
+
+    def test_parse_svg_path(self):
+        self.assertEqual(parse_svg_path("M 1.000 -2.500 L 3 4 Z"), [("M", [1.0, -2.5]), ("L", [3.0, 4.0]), ("Z", [])])
+        self.assertEqual(parse_svg_path(""), [])
+
+    def test_flatten_svg_path(self):
+        square = flatten_svg_path(parse_svg_path("M 0 0 L 4 0 L 4 4 L 0 4 Z M 1 1 L 2 1 L 2 2 Z"))
+        self.assertEqual(len(square), 2)
+        self.assertEqual(square[0].tolist(), [[0, 0], [4, 0], [4, 4], [0, 4]])
+        curve = flatten_svg_path(parse_svg_path("M 0 0 C 0 10 10 10 10 0 S 20 -10 20 0"))[0]
+        self.assertEqual(curve[-1].tolist(), [20, 0])
+        # the smooth curve mirrors the previous control point, so it bends downwards
+        self.assertLess(curve[:, 1].min(), -5)
+        self.assertEqual(flatten_svg_path(parse_svg_path("M 0 0 L 4 0"), 2.0), [])
+
+class TestRasterCanvas(unittest.TestCase):
+
+    def test_fill_square(self):
+        canvas = RasterCanvas(10, 10).fill_svg_path("M 2 2 L 8 2 L 8 8 L 2 8 Z")
+        self.assertEqual(canvas.pixels.sum(), 36)
+        self.assertTrue(canvas.pixels[2:8, 2:8].all())
+
+    def test_nonzero_rule(self):
+        same_direction = RasterCanvas(10, 10).fill_svg_path("M 1 1 L 9 1 L 9 9 L 1 9 Z M 3 3 L 7 3 L 7 7 L 3 7 Z")
+        self.assertEqual(same_direction.pixels.sum(), 64)
+        opposite_direction = RasterCanvas(10, 10).fill_svg_path("M 1 1 L 9 1 L 9 9 L 1 9 Z M 3 3 L 3 7 L 7 7 L 7 3 Z")
+        self.assertEqual(opposite_direction.pixels.sum(), 48)
+
+    def test_supersampling(self):
+        canvas = RasterCanvas(10, 10, 4).fill_svg_path("M 0 0 L 10 0 L 0 10 Z")
+        self.assertAlmostEqual(canvas.get_coverage().sum(), 50, delta = 1.5)
+        image = canvas.to_image()
+        self.assertEqual(image.size, (10, 10))
+        self.assertEqual(image.getpixel((9, 9)), (255, 255, 255))
+        self.assertEqual(image.getpixel((0, 0)), (0, 0, 0))
+
+    def test_rasterize_media(self):
+        media = DalmatianMedia(DlmtHeaders().set_brush_page_ratio(Fraction("1/10")))
+        media.add_view_string("view i:1 lang en-gb xy 0 0 width 1 height 1/2 flags O tags all but [ ] -> everything")
+        media.add_brush_string("brush i:1 ext-id brushes:square path [ M -1/2 -1/2,L 1/2 -1/2,L 1/2 1/2,L -1/2 1/2 ]")
+        media.add_brushstroke_string("brushstroke i:1 xy 1/4 1/4 scale 1 angle 0 tags [ ]")
+        canvas = rasterize_media(media, media.create_page_pixel_coordinate("i:1", 100))
+        self.assertEqual((canvas.width, canvas.height), (100, 50))
+        self.assertAlmostEqual(canvas.get_coverage().sum(), 100, delta = 1)
+        self.assertEqual(canvas.get_coverage()[25, 25], 1.0)
+
+class TestTiledRaster(unittest.TestCase):
+
+    def test_write_png_rows(self):
+        rows = array([[[0, 0, 0], [255, 255, 255], [10, 20, 30]]] * 2, dtype = "uint8")
+        content = io.BytesIO()
+        write_png_rows(content, 3, 4, iter([rows, rows]))
+        image = Image.open(io.BytesIO(content.getvalue()))
+        self.assertEqual(image.size, (3, 4))
+        self.assertEqual(image.getpixel((2, 3)), (10, 20, 30))
+
+    def test_tiles_match_single_pass(self):
+        with open("examples/one.dlmt", 'r') as dlmtfile:
+            media = DalmatianMedia.from_file(dlmtfile)
+        renderConfig = media.create_page_pixel_coordinate("i:1", 150)
+        expected = rasterize_media(media, renderConfig, 3).to_rgb()
+        for workers in [1, 2]:
+            content = io.BytesIO()
+            write_media_png_tiled(media, renderConfig, content, supersampling = 3, tile_size = 40, workers = workers)
+            self.assertTrue((array(Image.open(io.BytesIO(content.getvalue()))) == expected).all())
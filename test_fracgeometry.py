@@ -1,6 +1,8 @@
 import unittest
 from fractions import Fraction
-from fracgeometry import V2d, V2dList, VSegment, VPath, FractionList
+from math import radians, cos, sin
+from numpy import corrcoef, float64
+from fracgeometry import V2d, V2dRect, V2dList, V2dArrayList, V2dStats, SegmentShape, VSegment, VPath, FractionList, TrigTable, Affine2d, NumericPolicy, NumericMode, set_numeric_policy, cosFract, sinFract
 
 pt0 = V2d.from_string("0/1 0/1")
 ptA = V2d.from_string("1/4 1/3")
@@ -56,6 +58,99 @@ class TestV2d(unittest.TestCase):
         self.assertEqual((ptA-delta).is_inside_rect(ptA, width, width), False)
         self.assertEqual((ptA+delta.neg_y()).is_inside_rect(ptA, width, width), False)
 
+class TestTrigTable(unittest.TestCase):
+
+    def test_same_as_formula(self):
+        for angle in [Fraction(k, 97) for k in range(-200, 200)] + [Fraction(1, 4), Fraction(-3, 8)]:
+            self.assertEqual(cosFract(angle), Fraction("{}/1000".format(int(1000*cos(radians(360*angle))))))
+            self.assertEqual(sinFract(angle), Fraction("{}/1000".format(int(1000*sin(radians(360*angle))))))
+
+    def test_stats(self):
+        table = TrigTable(maxsize = 2).preload([Fraction("1/4")])
+        self.assertEqual(table.cos_sin(Fraction("1/4")), (Fraction(0), Fraction(1)))
+        table.cos(Fraction("1/7"))
+        table.sin(Fraction("1/7"))
+        table.cos(Fraction("2/7"))
+        table.cos(Fraction("3/7"))
+        table.cos(Fraction("1/7"))
+        self.assertEqual(table.get_stats(), { "fixed-hits": 1, "recent-hits": 1, "misses": 4, "fixed-size": 1, "recent-size": 2 })
+        self.assertEqual(table.hit_ratio(), 2/6)
+        self.assertEqual(table.clear().get_stats()["recent-size"], 0)
+
+class TestAffine2d(unittest.TestCase):
+
+    def test_apply(self):
+        self.assertEqual(Affine2d.identity().apply(ptA), ptA)
+        self.assertEqual(Affine2d.from_rotation(Fraction("1/4")).apply(ptA), ptA.rotate(Fraction("1/4")))
+        self.assertEqual(Affine2d.from_scale(Fraction("1/3")).apply(ptA), ptA*Fraction("1/3"))
+        self.assertEqual(Affine2d.from_translation(ptB).apply(ptA), ptA + ptB)
+        self.assertEqual(Affine2d.from_zoom(ptB, Fraction("1/2")).apply(ptA), (ptA - ptB)*Fraction(2))
+
+    def test_compose(self):
+        vpath = VPath.from_dalmatian_string("[ M -1/7 -1/9,L 1/7 -1/9, L 1/7 -1/11, Q 1/4 1/115 1/2 2/115,T 1/4 1/111,C 1/4 1/117 1/2 2/117 3/4 1/39,S 1/4 1/113 1/2 2/113,Z ]")
+        angle = Fraction("2/9")
+        affine = Affine2d.identity().rotate(angle).scale(Fraction("1/50")).scale(Fraction("3/2")).translate(ptE).zoom_to(ptB, Fraction("1/3"))
+        expected = vpath.rotate(angle).scale(Fraction("1/50")).scale(Fraction("3/2")).translate(ptE).translate(-ptB).scale(Fraction(3))
+        self.assertEqual(vpath.transform(affine), expected)
+        self.assertEqual(Affine2d.from_rotation(angle).then(Affine2d.from_translation(ptE)), Affine2d.identity().rotate(angle).translate(ptE))
+
+class TestNumericPolicy(unittest.TestCase):
+
+    def test_convert(self):
+        self.assertEqual(str(NumericPolicy.from_string("exact")), "exact")
+        self.assertEqual(str(NumericPolicy.from_string("fixed 1000")), "fixed 1000")
+        self.assertEqual(NumericPolicy.from_string("limit").mode, NumericMode.LIMIT_DENOMINATOR)
+        with self.assertRaises(Exception):
+            NumericPolicy.from_string("magic 10")
+
+    def test_normalize(self):
+        self.assertEqual(NumericPolicy.from_string("exact").normalize(Fraction("1/3")), Fraction("1/3"))
+        self.assertEqual(NumericPolicy.from_string("fixed 1000").normalize(Fraction("1/3")), Fraction("333/1000"))
+        self.assertEqual(NumericPolicy.from_string("fixed 1000").normalize(Fraction("1/4")), Fraction("1/4"))
+        self.assertEqual(NumericPolicy.from_string("limit 10").normalize(Fraction("1/3")), Fraction("1/3"))
+        self.assertEqual(NumericPolicy.from_string("limit 10").normalize(Fraction("33/100")), Fraction("1/3"))
+
+    def test_bounded_denominators(self):
+        previous = set_numeric_policy(NumericPolicy.from_string("fixed 1000000"))
+        try:
+            pt = ptA
+            for _ in range(50):
+                pt = pt.rotate(Fraction("1/7")) * Fraction("9/8") + ptB
+            self.assertTrue(1000000 % pt.x.denominator == 0)
+            self.assertTrue(1000000 % pt.y.denominator == 0)
+            vpath = VPath.from_dalmatian_string("[ M -1/7 -1/9,C 1/4 1/117 1/2 2/117 3/4 1/39,Z ]").rotate(Fraction("1/7")).scale(Fraction("1/3"))
+            coordinates = [value for pt in vpath.core_points() for value in [pt.x, pt.y]]
+            self.assertEqual([1000000 % value.denominator for value in coordinates], [0, 0, 0, 0])
+        finally:
+            set_numeric_policy(previous)
+        self.assertEqual(ptA * Fraction("1/3"), V2d.from_string("1/12 1/9"))
+
+class TestV2dStats(unittest.TestCase):
+
+    def test_incremental(self):
+        stats = V2dStats()
+        for pt in listABCDE.values:
+            stats.add(pt)
+        self.assertEqual(len(stats), 5)
+        self.assertAlmostEqual(stats.get_correlation(), corrcoef([float(v.x) for v in listABCDE.values], [float(v.y) for v in listABCDE.values])[0, 1])
+        self.assertEqual(stats.get_containing_rect(), V2dRect.from_opposite_points(V2d.from_string("-1/13 -1/9"), V2d.from_string("1/4 4/5")))
+        self.assertEqual(stats.get_quantile(Fraction("1/2")), V2d.from_string("1/7 1/6"))
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            V2dStats().get_containing_rect()
+        with self.assertRaises(ValueError):
+            V2dList([]).get_containing_rect()
+        with self.assertRaises(ValueError):
+            V2dArrayList.from_v2d_list(V2dList([])).get_containing_rect()
+
+    def test_median_range(self):
+        values = [V2d(Fraction(i*7 % 23, 23), Fraction(i*5 % 17, 17)) for i in range(40)]
+        xx = sorted([v.x for v in values])
+        yy = sorted([v.y for v in values])
+        self.assertEqual(V2dStats().extend(values).get_median_range(8), V2d(xx[-5] - xx[5], yy[-5] - yy[5]))
+        self.assertEqual(V2dList(values).get_median_range(8), V2d(xx[-5] - xx[5], yy[-5] - yy[5]))
+
 class TestV2dList(unittest.TestCase):
 
     def test_create(self):
@@ -115,6 +210,59 @@ class TestV2dList(unittest.TestCase):
     def test_get_containing_rect(self):
         self.assertEqual(listCDE.get_containing_rect().to_string(), "xy -1/13 -1/9 width 20/91 height 41/45" )
 
+class TestV2dArrayList(unittest.TestCase):
+
+    def test_create(self):
+        arrABCDE = V2dArrayList.from_v2d_list(listABCDE)
+        self.assertEqual(str(arrABCDE), str(listABCDE))
+        self.assertEqual(len(arrABCDE), 5)
+        self.assertEqual(arrABCDE[1], ptB)
+        self.assertEqual(arrABCDE[:4:2], [ptA, ptC])
+        self.assertEqual(V2dArrayList.from_dalmatian_string(listABCDE.to_dalmatian_string()), arrABCDE)
+        self.assertEqual(arrABCDE.to_v2d_list(), listABCDE)
+
+    def test_same_as_v2dlist(self):
+        arrABCDE = V2dArrayList.from_v2d_list(listABCDE)
+        arrCDE = V2dArrayList.from_v2d_list(listCDE)
+        self.assertEqual((arrABCDE + arrCDE).to_v2d_list(), listABCDE + listCDE)
+        self.assertEqual((arrABCDE - arrCDE).to_v2d_list(), listABCDE - listCDE)
+        self.assertEqual((arrCDE * Fraction("1/5")).to_v2d_list(), listCDE * Fraction("1/5"))
+        self.assertEqual((-arrCDE).to_v2d_list(), -listCDE)
+        self.assertEqual(arrCDE.neg_x().to_v2d_list(), listCDE.neg_x())
+        self.assertEqual(arrCDE.neg_y().to_v2d_list(), listCDE.neg_y())
+        self.assertEqual(arrCDE.reverse().to_v2d_list(), listCDE.reverse())
+        self.assertEqual(arrCDE.mirror().to_v2d_list(), listCDE.mirror())
+        self.assertEqual(arrABCDE.to_svg_string(100, 0), listABCDE.to_svg_string(100, 0))
+        self.assertEqual(arrABCDE.to_cartesian_string(100), listABCDE.to_cartesian_string(100))
+        self.assertEqual(arrCDE.get_containing_rect(), listCDE.get_containing_rect())
+        self.assertEqual(arrABCDE.get_median_range(4), listABCDE.get_median_range(4))
+        self.assertAlmostEqual(arrABCDE.get_correlation(), listABCDE.get_correlation(), places = 5)
+
+    def test_float_mode(self):
+        arrABCDE = V2dArrayList.from_v2d_list(listABCDE, exact = False)
+        self.assertFalse(arrABCDE.is_exact())
+        self.assertEqual(arrABCDE.to_svg_string(100, 0), listABCDE.to_svg_string(100, 0))
+        self.assertEqual((arrABCDE * Fraction("1/5")).to_svg_string(100, 0), (listABCDE * Fraction("1/5")).to_svg_string(100, 0))
+        self.assertEqual(V2dArrayList.from_v2d_list(listABCDE).to_float_mode(), arrABCDE)
+        exactCDE = V2dArrayList.from_v2d_list(listCDE)
+        for mixed in [exactCDE + arrABCDE, arrABCDE + exactCDE, exactCDE - arrABCDE]:
+            self.assertFalse(mixed.is_exact())
+        self.assertEqual((exactCDE + arrABCDE).to_svg_string(100, 0), (listCDE + listABCDE).to_svg_string(100, 0))
+        self.assertEqual((exactCDE - arrABCDE).to_svg_string(100, 0), (listCDE - listABCDE).to_svg_string(100, 0))
+
+    def test_large_operands(self):
+        bigList = V2dList.from_dalmatian_string("1/3000000000 1/3 12345678901234567890/7 2/9")
+        big = V2dArrayList.from_v2d_list(bigList)
+        self.assertEqual((big + big).to_v2d_list(), bigList + bigList)
+        self.assertEqual((big * Fraction("1/3000000001")).to_v2d_list(), bigList * Fraction("1/3000000001"))
+        self.assertEqual((big - V2dArrayList.from_v2d_list(listABCDE)).to_v2d_list(), bigList - listABCDE)
+        self.assertEqual(big.to_float_array().dtype, float64)
+
+    def test_select(self):
+        arrABCDE = V2dArrayList.from_v2d_list(listABCDE)
+        self.assertEqual(arrABCDE.select(slice(None, 4, 2)).to_v2d_list(), V2dList([ptA, ptC]))
+        self.assertEqual(arrABCDE.select(slice(None, None, -1)), arrABCDE.reverse())
+
 class TestVSegment(unittest.TestCase):
 
     def test_to_dalmatian_string(self):
@@ -125,6 +273,11 @@ class TestVSegment(unittest.TestCase):
         self.assertEqual(VSegment.from_smooth_bezier(ptE, ptC).to_dalmatian_string(), "S 1/7 -1/9 1/17 4/5")
         self.assertEqual(VSegment.from_quadratic_bezier(ptE, ptC).to_dalmatian_string(), "Q 1/7 -1/9 1/17 4/5")
 
+    def test_from_points(self):
+        for segment in [VSegment.from_close(), VSegment.from_line_to(ptC), VSegment.from_cubic_bezier(ptE, ptC, ptD), VSegment.from_smooth_bezier(ptE, ptC), VSegment()]:
+            self.assertEqual(VSegment.from_points(segment.action, segment.get_points()), segment)
+        self.assertEqual(VSegment.from_points(SegmentShape.LINE_TO, [ptA, ptB]), VSegment())
+
     def test_from_dalmatian_string(self):
         self.assertEqual(VSegment.from_dalmatian_string("Z").to_dalmatian_string(), "Z")
         self.assertEqual(VSegment.from_dalmatian_string("L 1/7 -1/9").to_dalmatian_string(), "L 1/7 -1/9")
@@ -179,6 +332,36 @@ class TestVPath(unittest.TestCase):
         dpath = "[ M -1/7 -1/9,L 1/7 -1/9,Q 1/4 1/115 1/2 2/115,T 1/4 1/111,C 1/4 1/117 1/2 2/117 3/4 1/39,S 1/4 1/113 1/2 2/113,Z ]"
         self.assertEqual(VPath.from_dalmatian_string(dpath).to_dalmatian_string(), dpath)
 
+    def test_tokenizer(self):
+        dpath = "[ M -1/7 -1/9,L 1/7 -1/9, Q 1/4 1/115 1/2 2/115,T 1/4 1/111,C 1/4 1/117 1/2 2/117 3/4 1/39,S 1/4 1/113 1/2 2/113,Z ]"
+        self.assertEqual(VPath.from_dalmatian_string(dpath), VPath.from_dalmatian_string_by_split(dpath))
+        self.assertEqual(VPath.from_dalmatian_string("[ M 0.5 1, l 1 2, L 1, Z ]").to_dalmatian_string(), "[ M 1/2 1,E,E,Z ]")
+        self.assertEqual(len(VPath.from_dalmatian_string("[  ]")), 0)
+        self.assertEqual(VPath.from_dalmatian_string_list([dpath, "[ M 1 1,L 0 0 ]", dpath]), [VPath.from_dalmatian_string(dpath), VPath.from_dalmatian_string("[ M 1 1,L 0 0 ]"), VPath.from_dalmatian_string(dpath)])
+
+    def test_bounding_box(self):
+        vpath = VPath.from_dalmatian_string("[ M -1/7 -1/9,L 1/7 -1/9,C 1/4 1/117 1/2 2/117 3/4 1/39,Z ]")
+        self.assertEqual(vpath.get_bounding_box(), V2dRect.from_opposite_points(V2d.from_string("-1/7 -1/9"), V2d.from_string("3/4 1/39")))
+        self.assertEqual(vpath.get_bounding_box(control_points = True), V2dRect.from_opposite_points(V2d.from_string("-1/7 -1/9"), V2d.from_string("3/4 1/39")))
+        self.assertIs(vpath.get_bounding_box(), vpath.get_bounding_box())
+        self.assertEqual(VPath([]).get_bounding_box(), None)
+
+    def test_inside_rect(self):
+        vpath = VPath.from_dalmatian_string("[ M -1/7 -1/9,L 1/7 -1/9,C 1/4 1/117 1/2 2/117 3/4 1/39,Z ]")
+        for xy, width in [("-1 -1", "2"), ("-1/7 -1/9", "1"), ("0 -1", "2"), ("-1/2 -1/2", "1/2"), ("2 2", "1")]:
+            rect = V2dRect(V2d.from_string(xy), Fraction(width), Fraction(width))
+            expected = set([ segment.is_mostly_inside_rect(rect.xy, rect.width, rect.height) for segment in vpath.segments]) == set([True])
+            self.assertEqual(vpath.is_inside_rect(rect), expected)
+            self.assertEqual(vpath.is_mostly_inside_rect(rect.xy, rect.width, rect.height), expected)
+        self.assertFalse(VPath([]).is_inside_rect(rect))
+
+    def test_intersects_rect(self):
+        vpath = VPath.from_dalmatian_string("[ M 0 0,L 1 1,L 1 0,Z ]")
+        self.assertTrue(vpath.intersects_rect(V2dRect(V2d.from_string("-1 -1"), Fraction(3), Fraction(3))))
+        self.assertTrue(vpath.intersects_rect(V2dRect(V2d.from_string("1/2 -1/2"), Fraction(1), Fraction(1))))
+        self.assertFalse(vpath.intersects_rect(V2dRect(V2d.from_string("2 2"), Fraction(1), Fraction(1))))
+        self.assertFalse(vpath.intersects_rect(V2dRect(V2d.from_string("1/4 1/2"), Fraction(1, 8), Fraction(1, 8))))
+
     def test_to_core_cartesian_string(self):
         vpath = VPath.from_dalmatian_string("[ M -1/7 -1/9,L 1/7 -1/9,Q 1/4 1/115 1/2 2/115,T 1/4 1/111,C 1/4 1/117 1/2 2/117 3/4 1/39,S 1/4 1/113 1/2 2/113,Z ]")
         self.assertEqual(vpath.to_core_cartesian_string(100, ";"), "(-14.286,-11.111);(14.286,-11.111);(50.000,1.739);(25.000,0.901);(75.000,2.564);(50.000,1.770)")
@@ -1,7 +1,8 @@
 import unittest
 from fractions import Fraction
-from fracgeometry import V2d, V2dList, VSegment, VPath, FractionList
-from tortuga import TortugaConfig, TortugaState, TortugaAction, TortugaProducer, TortugaRuleMaker, TortugaTargetRand, TortugaActionRange
+from random import Random
+from fracgeometry import V2d, V2dList, VSegment, VPath, FractionList, NumericPolicy, set_numeric_policy
+from tortuga import TortugaConfig, TortugaState, TortugaAction, TortugaProducer, TortugaOpcode, TortugaProgram, TortugaCompiledProducer, TortugaBatchProducer, TortugaStats, abort_when_outside_above, TortugaRuleMaker, TortugaTargetRand, TortugaActionRange
 
 refconfig = TortugaConfig()
 refconfig.set_angles_string("0/1 1/4 1/2 3/4").set_magnitudes_string("1 2 3 4 5")
@@ -10,6 +11,9 @@ refconfig.set_tags(["", "i:1", "i:2"])
 refconfig.set_magnitude_page_ratio_string("1/100").set_scale_magnitude_ratio_string("3/2")
 refconfig.set_chain("Z")
 
+# the walk adds floats where produce adds fractions
+WALK_TOLERANCE = 1e-12
+
 class TestTortugaAction(unittest.TestCase):
     def test(self):
         self.assertEqual(TortugaAction.from_string(TortugaAction.to_string(TortugaAction.ANGLE)), TortugaAction.ANGLE)
@@ -55,6 +59,15 @@ class TestTortugaState(unittest.TestCase):
         self.assertEqual(state.activate_verb(TortugaAction.PREVIOUS).create_brushstroke(), "brushstroke i:1 xy 2/25 1/10 scale 3/2 angle 1/2 tags [  ]")
         self.assertEqual(state.activate_verb(TortugaAction.NEGATE).create_brushstroke(), "brushstroke i:1 xy 7/100 1/10 scale 3/2 angle -1/2 tags [  ]")
     
+    def test_save_restore(self):
+        state = TortugaState(refconfig.clone().set_xy_string("10/100 10/100")).set_target(TortugaAction.ANGLE)
+        saved = state.activate_verb(TortugaAction.NEXT).save()
+        clone = state.clone()
+        state.activate_verb(TortugaAction.NEXT).set_target(TortugaAction.BRUSH).activate_verb(TortugaAction.NEXT).create_brushstroke()
+        self.assertEqual(clone.create_brushstroke(), "brushstroke i:1 xy 1/10 11/100 scale 3/2 angle 1/4 tags [  ]")
+        self.assertEqual(state.restore(saved).create_brushstroke(), "brushstroke i:1 xy 1/10 11/100 scale 3/2 angle 1/4 tags [  ]")
+        self.assertEqual(state.target, TortugaAction.ANGLE)
+
     def test_angle_offset(self):
         state = TortugaState(refconfig.clone().set_xy_string("10/100 10/100").set_brushstoke_angle_offset_string("1/5")).set_target(TortugaAction.ANGLE)
         self.assertEqual(state.activate_verb(TortugaAction.NEXT).create_brushstroke(), "brushstroke i:1 xy 1/10 11/100 scale 3/2 angle 9/20 tags [  ]")
@@ -77,11 +90,121 @@ class TestTortugaProducer(unittest.TestCase):
         brushstokes = producer.produce()
         self.assertEqual(brushstokes[2],brushstokes[-1])
    
+    def test_produce_restore_cycles(self):
+        config = refconfig.clone().set_xy_string("10/100 10/100").set_chain("A>L>[A>L>B>P]P")
+        brushstokes = TortugaProducer(config).produce()
+        self.assertEqual(brushstokes[0], "brushstroke i:2 xy 7/100 1/10 scale 9/2 angle 1/2 tags [  ]")
+        self.assertEqual(brushstokes[1], "brushstroke i:1 xy 1/10 3/25 scale 3 angle 1/4 tags [  ]")
+
     def test_produce_longchain(self):
         config = refconfig.clone().set_xy_string("10/100 10/100").set_chain("PAB>P<APL>P")
         producer = TortugaProducer(config)
         self.assertEqual(len(producer.produce()), 4)
 
+    def test_iter_produce(self):
+        config = refconfig.clone().set_xy_string("10/100 10/100").set_chain("PPPPP")
+        for producer in [TortugaProducer(config), TortugaCompiledProducer(config)]:
+            self.assertEqual(next(producer.iter_produce()), "brushstroke i:1 xy 11/100 1/10 scale 3/2 angle 0 tags [  ]")
+            stats = TortugaStats(producer.count_points())
+            self.assertEqual(len(producer.produce(stats, lambda running: running.count >= 2)), 2)
+            self.assertTrue(producer.aborted)
+            self.assertEqual(len(producer.produce(TortugaStats(), lambda running: False)), 5)
+            self.assertFalse(producer.aborted)
+            self.assertEqual(len(producer.produce(abort = lambda running: running.count >= 3)), 3)
+        # a production after an abort starts again from the start of the chain
+        config = refconfig.clone().set_xy_string("10/100 10/100").set_chain("PA>P[L-PPA-P[PL>>P]PB>P]PPL<PA<PA-P" * 5)
+        producer, compiled = TortugaProducer(config), TortugaCompiledProducer(config)
+        for count in [13, 11, 40]:
+            aborted = producer.produce(TortugaStats(), lambda running: running.count >= count)
+            self.assertEqual(aborted, compiled.produce(TortugaStats(), lambda running: running.count >= count))
+            self.assertEqual([brushstroke.xy for brushstroke in aborted], [brushstroke.xy for brushstroke in compiled.produce()[:count]])
+            self.assertEqual(producer.produce(), compiled.produce())
+
+    def test_produce_abort_outside(self):
+        config = refconfig.clone().set_xy_string("90/100 1/2").set_chain("L>>>>PPPPPPPPPP")
+        for producer in [TortugaProducer(config), TortugaCompiledProducer(config)]:
+            stats = TortugaStats(producer.count_points(), 0.02)
+            brushstokes = producer.produce(stats, abort_when_outside_above(Fraction(1, 5)))
+            self.assertTrue(producer.aborted)
+            self.assertEqual(len(brushstokes), 5)
+            self.assertEqual(stats.outside, 3)
+            self.assertEqual(stats.get_containing_rect().xy, V2d.from_string("95/100 1/2"))
+
+class TestTortugaCompiledProducer(unittest.TestCase):
+    def assertWalkClose(self, config: TortugaConfig, tolerance: float = WALK_TOLERANCE):
+        positions, scales, angles, brushes = TortugaCompiledProducer(config).produce_arrays()
+        expected = TortugaProducer(config).produce()
+        self.assertEqual(len(positions), len(expected))
+        for (x, y), scale, angle, brush, brushstroke in zip(positions, scales, angles, brushes, expected):
+            self.assertLessEqual(abs(x - float(brushstroke.xy.x)), tolerance)
+            self.assertLessEqual(abs(y - float(brushstroke.xy.y)), tolerance)
+            self.assertEqual((scale, angle, config.brushids[brush]), (float(brushstroke.scale), float(brushstroke.angle), brushstroke.brushid))
+
+    def test_produce_arrays(self):
+        for chain in ["", "PPPPP", "[]PP[", "PP[PPP]P", "AZ-P>L>>-P[A<PL<P[B>PP]P]PL>[P]AZP", "L>>[L<P]PA>[>P]P"]:
+            self.assertWalkClose(refconfig.clone().set_xy_string("10/100 10/100").set_chain(chain))
+        config = refconfig.clone().set_xy_string("1/3 2/7").set_angles_string("1/7 2/9 -1/3").set_magnitudes_string("5/3 1/11 7")
+        self.assertWalkClose(config.set_chain("PA>P[L-PPA-P[PL>>P]PB>P]PPL<PA<PA-P" * 20))
+
+    def test_compile(self):
+        self.assertEqual(list(TortugaProgram.from_chain("PAB>>P").opcodes), [TortugaOpcode.POINT, TortugaOpcode.BRUSH_NEXT, TortugaOpcode.BRUSH_NEXT, TortugaOpcode.POINT])
+        # the restore brings back the magnitude target and a restore without a save is dropped
+        self.assertEqual(list(TortugaProgram.from_chain("]L[A>]-xT").opcodes), [TortugaOpcode.SAVE, TortugaOpcode.ANGLE_NEXT, TortugaOpcode.RESTORE, TortugaOpcode.MAGNITUDE_NEGATE])
+        with self.assertRaises(Exception):
+            TortugaProgram.from_chain("B-")
+
+    def test_branch_runs(self):
+        # (start, length, parent, points before the parent end) per run
+        runs = TortugaProgram.from_chain("PP[PPP[]]P[P]]P").branch_runs()
+        self.assertEqual([list(values) for values in runs], [[0, 2, 5, 6, 7], [2, 3, 1, 1, 1], [-1, 0, 0, 2, 2], [0, 2, 2, 6, 6]])
+
+    def test_produce(self):
+        for chain in ["PPPPP", "PAB>>P", "PP[PPP]P", "PAB>P<APL>P", "AZ-P>L>>-P[A<PL<P[B>PP]P]PL>[P]AZP", "L>>[L<P]PA>[>P]P"]:
+            config = refconfig.clone().set_xy_string("10/100 10/100").set_chain(chain)
+            self.assertEqual(TortugaCompiledProducer(config).produce(), TortugaProducer(config).produce())
+
+    def test_produce_numeric_policy(self):
+        config = refconfig.clone().set_xy_string("1/3 2/7").set_angles_string("1/7 2/9 -1/3").set_magnitudes_string("5/3 1/11 7")
+        rand = Random(7)
+        chains = ["".join(rand.choice("PPPAL><Z-[]") for _ in range(60)) for _ in range(30)]
+        for policy in ["fixed 1000000", "limit 1000"]:
+            previous = set_numeric_policy(NumericPolicy.from_string(policy))
+            try:
+                for chain in chains:
+                    config.set_chain(chain)
+                    self.assertEqual(TortugaCompiledProducer(config).produce(), TortugaProducer(config).produce())
+            finally:
+                set_numeric_policy(previous)
+
+    def test_produce_records(self):
+        config = refconfig.clone().set_xy_string("10/100 10/100").set_chain("A>PL>P[A-P]P")
+        producer = TortugaCompiledProducer(config)
+        expected = TortugaProducer(config).produce()
+        for fixed_point in [True, False]:
+            records = producer.produce_records(fixed_point)
+            self.assertEqual(len(records), len(expected))
+            denominator = producer.denominator if fixed_point else 1
+            for (brushid, x, y, scale, angle), brushstroke in zip(records, expected):
+                self.assertEqual((brushid, scale, angle), (brushstroke.brushid, brushstroke.scale, brushstroke.angle))
+                self.assertAlmostEqual(x / denominator, float(brushstroke.xy.x))
+                self.assertAlmostEqual(y / denominator, float(brushstroke.xy.y))
+
+class TestTortugaBatchProducer(unittest.TestCase):
+    def test_produce_arrays(self):
+        batch = TortugaBatchProducer(refconfig.clone().set_xy_string("10/100 10/100").set_chain("PA>P[L-PPA-P[PL>>P]PB>P]PPL<PA<PA-P" * 5))
+        variations = [
+            (FractionList.from_string("0 1/4 1/2"), FractionList.from_string("1 2"), ["i:1", "i:2"]),
+            (FractionList.from_string("1/7 2/9 1/3"), FractionList.from_string("5/3 7"), ["i:3", "i:1"]),
+            (FractionList.from_string("1/8"), FractionList.from_string("1 2 3"), ["i:2"])
+        ]
+        results = batch.produce_arrays(variations)
+        self.assertEqual(len(results), 3)
+        for variation, result in zip(variations, results):
+            expected = TortugaCompiledProducer(batch.configure(*variation)).produce_arrays()
+            for values, expected_values in zip(result, expected):
+                self.assertTrue((values == expected_values).all())
+        self.assertEqual(len(batch.program.walks), 2)
+
 class TestTortugaTargetRand(unittest.TestCase):
     def test_choice(self):
         self.assertEqual(TortugaTargetRand.from_string("L <").choice(), "L<")
@@ -1,9 +1,13 @@
 from fractions import Fraction
 from typing import List, Tuple, Dict, Set, TypeVar, Generic
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
 from collections import deque
+from array import array
+from math import gcd
+from functools import reduce
+from numpy import asarray, concatenate, cumsum, empty, float64, int64, repeat, zeros
 from random import sample, choice, randint, shuffle
-from fracgeometry import V2d, V2dList, VSegment, VPath, FractionList
+from fracgeometry import V2d, V2dList, V2dStats, VSegment, VPath, FractionList, get_numeric_policy
 from dalmatianmedia import DlmtBrushstroke
 
 
@@ -83,7 +87,8 @@ class TortugaCycle(Generic[T]):
         self.idx = idx
     
     def clone(self)->T:
-        return TortugaCycle(self.values.copy(), self.idx)
+        # the values come from the config and are never changed
+        return TortugaCycle(self.values, self.idx)
 
     def next(self)->T:
         idx = self.idx + 1
@@ -211,9 +216,9 @@ class TortugaState:
         self.xy = xy
         return self
 
-    def set_cycles(self, anglecycle: (TortugaCycle[Fraction], TortugaCycle[int]), amplitudecycle: (TortugaCycle[Fraction],  TortugaCycle[int]),  brushcycle: TortugaCycle[str], tagcycle: TortugaCycle[str]):
+    def set_cycles(self, anglecycle: (TortugaCycle[Fraction], TortugaCycle[int]), magnitudecycle: (TortugaCycle[Fraction],  TortugaCycle[int]),  brushcycle: TortugaCycle[str], tagcycle: TortugaCycle[str]):
         self.anglecycle = anglecycle
-        self.amplitudecycle = amplitudecycle
+        self.magnitudecycle = magnitudecycle
         self.brushcycle = brushcycle
         self.tagcycle = tagcycle
         return self
@@ -257,7 +262,18 @@ class TortugaState:
         return self
         
     def clone(self):
-        return TortugaState(self.config).set_position(self.xy, self.previous_xy).set_cycles(self.anglecycle, self.magnitudecycle, self.brushcycle, self.tagcycle).set_target(self.target)
+        anglecycle = (self.anglecycle[0].clone(), self.anglecycle[1].clone())
+        magnitudecycle = (self.magnitudecycle[0].clone(), self.magnitudecycle[1].clone())
+        return TortugaState(self.config).set_position(self.xy, self.previous_xy).set_cycles(anglecycle, magnitudecycle, self.brushcycle.clone(), self.tagcycle.clone()).set_target(self.target)
+
+    # The positions are never changed in place, so a save only needs the
+    # small fields and a restore writes them back into the same cycles
+    def save(self)->Tuple:
+        return (self.xy, self.previous_xy, self.anglecycle[0].idx, self.anglecycle[1].idx, self.magnitudecycle[0].idx, self.magnitudecycle[1].idx, self.brushcycle.idx, self.tagcycle.idx, self.target)
+
+    def restore(self, saved: Tuple):
+        self.xy, self.previous_xy, self.anglecycle[0].idx, self.anglecycle[1].idx, self.magnitudecycle[0].idx, self.magnitudecycle[1].idx, self.brushcycle.idx, self.tagcycle.idx, self.target = saved
+        return self
    
     def angle_previous_vector(self):
         if self.xy == self.previous_xy:
@@ -296,6 +312,26 @@ class TortugaState:
 
 
 
+# V2dStats that also counts the points outside the unit page grown by a margin,
+# out of the total number of points the chain will produce
+class TortugaStats(V2dStats):
+    def __init__(self, total: int = 0, margin: float = 0.0):
+        super().__init__()
+        self.total = total
+        self.margin = margin
+        self.outside = 0
+
+    def add(self, pt: V2d):
+        super().add(pt)
+        x, y = float(pt.x), float(pt.y)
+        if x < -self.margin or x > 1 + self.margin or y < -self.margin or y > 1 + self.margin:
+            self.outside += 1
+        return self
+
+def abort_when_outside_above(ratio: Fraction):
+    # the points outside can only grow, so the production stops once too many of the total are outside
+    return lambda stats: stats.outside > ratio * stats.total
+
 class TortugaProducer:
     def __init__(self, config: TortugaConfig):
         self.config = config
@@ -303,19 +339,29 @@ class TortugaProducer:
         self.actions = [action for action in anyactions if action != TortugaAction.IGNORE]
         self.state = TortugaState(config)
         self.state_stack = deque()
+        self.aborted = False
 
     def _save_state(self):
-        self.state_stack.append(self.state.clone())
+        self.state_stack.append(self.state.save())
 
     def _restore_state(self):
         if len(self.state_stack) > 0:
-            self.state = self.state_stack.pop()
+            self.state.restore(self.state_stack.pop())
     
     def _reset_state(self):
+        self.state = TortugaState(self.config)
         self.state_stack = deque()
 
-    def produce(self)->List[DlmtBrushstroke]:
-        results = []
+    def count_points(self)->int:
+        return self.actions.count(TortugaAction.POINT)
+
+    def iter_produce(self, stats: V2dStats = None, abort = None):
+        # abort is called with the stats after each brushstroke and stops the production when true.
+        # Each production starts again from the start of the chain
+        self.aborted = False
+        self._reset_state()
+        if abort is not None and stats is None:
+            stats = TortugaStats()
         for action in self.actions:
             if action in [TortugaAction.ANGLE, TortugaAction.MAGNITUDE, TortugaAction.BRUSH]:
                 self.state.set_target(action)
@@ -323,12 +369,320 @@ class TortugaProducer:
                 self.state.activate_verb(action)
             elif action == TortugaAction.POINT:
                 brushstoke = self.state.create_brushstroke()
-                results.append(brushstoke)
+                if stats is not None:
+                    stats.add(brushstoke.xy)
+                yield brushstoke
+                if abort is not None and abort(stats):
+                    self.aborted = True
+                    return
             elif action == TortugaAction.SAVE:
                 self._save_state()
             elif action == TortugaAction.RESTORE:
                 self._restore_state()
 
+    def produce(self, stats: V2dStats = None, abort = None)->List[DlmtBrushstroke]:
+        return list(self.iter_produce(stats, abort))
+
+# Opcodes of a compiled chain. A verb is folded with its target because the
+# target is known when the chain is read, even after a restore.
+class TortugaOpcode(IntEnum):
+    ANGLE_NEXT = 0
+    ANGLE_PREVIOUS = 1
+    ANGLE_RESET = 2
+    ANGLE_NEGATE = 3
+    MAGNITUDE_NEXT = 4
+    MAGNITUDE_PREVIOUS = 5
+    MAGNITUDE_RESET = 6
+    MAGNITUDE_NEGATE = 7
+    BRUSH_NEXT = 8
+    BRUSH_PREVIOUS = 9
+    BRUSH_RESET = 10
+    POINT = 11
+    SAVE = 12
+    RESTORE = 13
+
+TORTUGA_TARGETS = {TortugaAction.ANGLE, TortugaAction.MAGNITUDE, TortugaAction.BRUSH}
+TORTUGA_VERBS = {TortugaAction.NEGATE, TortugaAction.NEXT, TortugaAction.PREVIOUS, TortugaAction.RESET}
+
+TORTUGA_VERB_OPCODES = {
+    (TortugaAction.NEXT, TortugaAction.ANGLE): TortugaOpcode.ANGLE_NEXT,
+    (TortugaAction.PREVIOUS, TortugaAction.ANGLE): TortugaOpcode.ANGLE_PREVIOUS,
+    (TortugaAction.RESET, TortugaAction.ANGLE): TortugaOpcode.ANGLE_RESET,
+    (TortugaAction.NEGATE, TortugaAction.ANGLE): TortugaOpcode.ANGLE_NEGATE,
+    (TortugaAction.NEXT, TortugaAction.MAGNITUDE): TortugaOpcode.MAGNITUDE_NEXT,
+    (TortugaAction.PREVIOUS, TortugaAction.MAGNITUDE): TortugaOpcode.MAGNITUDE_PREVIOUS,
+    (TortugaAction.RESET, TortugaAction.MAGNITUDE): TortugaOpcode.MAGNITUDE_RESET,
+    (TortugaAction.NEGATE, TortugaAction.MAGNITUDE): TortugaOpcode.MAGNITUDE_NEGATE,
+    (TortugaAction.NEXT, TortugaAction.BRUSH): TortugaOpcode.BRUSH_NEXT,
+    (TortugaAction.PREVIOUS, TortugaAction.BRUSH): TortugaOpcode.BRUSH_PREVIOUS,
+    (TortugaAction.RESET, TortugaAction.BRUSH): TortugaOpcode.BRUSH_RESET
+}
+
+# The cycle indices are flat registers: angle, angle sign, magnitude, magnitude sign and brush
+TORTUGA_ANGLE_REGISTER = 0
+TORTUGA_ANGLE_SIGN_REGISTER = 1
+TORTUGA_MAGNITUDE_REGISTER = 2
+TORTUGA_MAGNITUDE_SIGN_REGISTER = 3
+TORTUGA_BRUSH_REGISTER = 4
+
+# (register, step) of each verb opcode, a zero step resets the register
+TORTUGA_VERB_STEPS = [
+    (TORTUGA_ANGLE_REGISTER, 1), (TORTUGA_ANGLE_REGISTER, -1), (TORTUGA_ANGLE_REGISTER, 0), (TORTUGA_ANGLE_SIGN_REGISTER, 1),
+    (TORTUGA_MAGNITUDE_REGISTER, 1), (TORTUGA_MAGNITUDE_REGISTER, -1), (TORTUGA_MAGNITUDE_REGISTER, 0), (TORTUGA_MAGNITUDE_SIGN_REGISTER, 1),
+    (TORTUGA_BRUSH_REGISTER, 1), (TORTUGA_BRUSH_REGISTER, -1), (TORTUGA_BRUSH_REGISTER, 0)
+]
+
+class TortugaProgram:
+    def __init__(self, opcodes: array):
+        self.opcodes = opcodes
+        self.walks = {}
+        self.runs = None
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    @classmethod
+    def from_chain(cls, chain: str):
+        opcodes = array('B')
+        target = TortugaAction.ANGLE
+        targets = deque()
+        for c in chain:
+            action = TortugaAction.from_string(c)
+            if action in TORTUGA_TARGETS:
+                target = action
+            elif action in TORTUGA_VERBS:
+                opcode = TORTUGA_VERB_OPCODES.get((action, target))
+                if opcode is None:
+                    raise Exception("Unexpected verb {} and target {}".format(action, target))
+                opcodes.append(opcode)
+            elif action == TortugaAction.POINT:
+                opcodes.append(TortugaOpcode.POINT)
+            elif action == TortugaAction.SAVE:
+                targets.append(target)
+                opcodes.append(TortugaOpcode.SAVE)
+            elif action == TortugaAction.RESTORE and len(targets) > 0:
+                # a restore without a save does nothing
+                target = targets.pop()
+                opcodes.append(TortugaOpcode.RESTORE)
+        return cls(opcodes)
+
+    def walk_registers(self, sizes: List[int])->Tuple[List[int], List[int]]:
+        # The cycles never depend on the positions, so one pass over the opcodes
+        # gives the move index and the brush index of every point. It only
+        # depends on the sizes of the cycles, so it is kept per sizes.
+        key = tuple(sizes)
+        if key in self.walks:
+            return self.walks[key]
+        steps = TORTUGA_VERB_STEPS
+        count_magnitudes = sizes[TORTUGA_MAGNITUDE_REGISTER]
+        point, save, restore = int(TortugaOpcode.POINT), int(TortugaOpcode.SAVE), int(TortugaOpcode.RESTORE)
+        registers = [0, 0, 0, 0, 0]
+        stack = []
+        moves, brushes = [], []
+        for opcode in self.opcodes:
+            if opcode == point:
+                angle_idx, angle_sign, magnitude_idx, magnitude_sign, brush_idx = registers
+                moves.append(((angle_idx*2 + angle_sign)*count_magnitudes + magnitude_idx)*2 + magnitude_sign)
+                brushes.append(brush_idx)
+            elif opcode == save:
+                stack.append(tuple(registers))
+            elif opcode == restore:
+                registers[:] = stack.pop()
+            else:
+                register, step = steps[opcode]
+                registers[register] = (registers[register] + step) % sizes[register] if step != 0 else 0
+        self.walks[key] = (moves, brushes)
+        return self.walks[key]
+
+    def branch_runs(self)->Tuple:
+        # The points between two branch markers form a run. Each run continues
+        # from the end of a parent run, or from the start when the parent is -1.
+        # Gives the (start, length, parent, points before the parent end) of the runs
+        if self.runs is not None:
+            return self.runs
+        point, save, restore = int(TortugaOpcode.POINT), int(TortugaOpcode.SAVE), int(TortugaOpcode.RESTORE)
+        starts, lengths, parents, sources = [], [], [], []
+        stack = []
+        current = (-1, 0)
+        start = count = 0
+        for opcode in self.opcodes:
+            if opcode == point:
+                count += 1
+            elif opcode == save or opcode == restore:
+                if count > start:
+                    starts.append(start)
+                    lengths.append(count - start)
+                    parents.append(current[0])
+                    sources.append(current[1])
+                    current = (len(starts) - 1, count)
+                start = count
+                if opcode == save:
+                    stack.append(current)
+                else:
+                    current = stack.pop()
+        if count > start:
+            starts.append(start)
+            lengths.append(count - start)
+            parents.append(current[0])
+            sources.append(current[1])
+        self.runs = tuple(asarray(values, dtype=int64) for values in (starts, lengths, parents, sources))
+        return self.runs
+
+def walk_runs(steps_x, steps_y, xs, ys, runs: Tuple):
+    # Steps (C, N) and starts (C,) to positions (C, N, 2) for the branch runs
+    # of TortugaProgram.branch_runs. The steps are summed once over the whole
+    # chain and each run is shifted by the jump from the end of its parent run,
+    # the jumps of the ancestors being added by pointer jumping on the parents
+    configs, count = steps_x.shape
+    positions = empty((configs, count, 2), dtype=float64)
+    if count == 0:
+        return positions
+    starts, lengths, parents, sources = runs
+    sums = cumsum(concatenate((zeros((2*configs, 1), dtype=float64), concatenate((steps_x, steps_y))), axis=1), axis=1)
+    offsets = sums[:, sources] - sums[:, starts]
+    offsets[:, parents < 0] += concatenate((xs, ys))[:, None]
+    parents = parents.copy()
+    while (parents >= 0).any():
+        jumping = parents >= 0
+        offsets[:, jumping] += offsets[:, parents[jumping]]
+        parents[jumping] = parents[parents[jumping]]
+    walked = sums[:, 1:] + repeat(offsets, lengths, axis=1)
+    positions[:, :, 0] = walked[:configs]
+    positions[:, :, 1] = walked[configs:]
+    return positions
+
+# Runs a compiled chain on integer cycle indices with the position moves
+# tabulated per (angle, sign, magnitude, sign). The moves are exact integers
+# over a common denominator, or floats.
+class TortugaCompiledProducer:
+    def __init__(self, config: TortugaConfig, program: TortugaProgram = None):
+        self.config = config
+        self.program = TortugaProgram.from_chain(config.chain) if program is None else program
+        self.aborted = False
+        self._tabulate()
+
+    def _tabulate(self):
+        config = self.config
+        angles, magnitudes = config.angles, config.magnitudes
+        self.sizes = [len(angles), 2, len(magnitudes), 2, len(config.brushids)]
+        # the angle of the previous vector is left out: V2d.get_angle truncates it to whole turns, so it is always 0
+        deltas = [V2d.from_amplitude_angle(magnitude*config.magnitude_page_ratio*msign, asign*angle) for angle in angles for asign in [1, -1] for magnitude in magnitudes for msign in [1, -1]]
+        self.scales = [magnitude*config.scale_magnitude_ratio for magnitude in magnitudes]
+        self.brush_angles = [Fraction(0) + asign*angle + config.brushstoke_angle_offset for angle in angles for asign in [1, -1]]
+        tag = config.tags[0]
+        self.tags = [] if tag == "" else [tag]
+        xy = config.xy
+        self.policy = get_numeric_policy()
+        self.float_moves = ([float(delta.x) for delta in deltas], [float(delta.y) for delta in deltas], float(xy.x), float(xy.y))
+        if not self.policy.exact:
+            # the policy rounds every position, so the positions stay fractions
+            self.denominator = 1
+            self.fixed_moves = ([delta.x for delta in deltas], [delta.y for delta in deltas], xy.x, xy.y)
+            return
+        dens = [Fraction(xy.x).denominator, Fraction(xy.y).denominator] + [Fraction(delta.x).denominator for delta in deltas] + [Fraction(delta.y).denominator for delta in deltas]
+        self.denominator = reduce(lambda a, b: a*b // gcd(a, b), dens, 1)
+        self.fixed_moves = ([int(delta.x*self.denominator) for delta in deltas], [int(delta.y*self.denominator) for delta in deltas], int(xy.x*self.denominator), int(xy.y*self.denominator))
+
+    def count_points(self)->int:
+        return self.program.opcodes.count(TortugaOpcode.POINT)
+
+    def iter_records(self, fixed_point: bool = True):
+        # one (brushid, x, y, scale, angle) per point, x and y in units of 1/denominator when fixed_point.
+        # The numeric policy active when the producer was created rounds each position like V2d.__add__
+        dxs, dys, x, y = self.fixed_moves if fixed_point else self.float_moves
+        normalize = self.policy.normalize if fixed_point and not self.policy.exact else None
+        sizes, steps = self.sizes, TORTUGA_VERB_STEPS
+        brushids, scales, brush_angles = self.config.brushids, self.scales, self.brush_angles
+        count_magnitudes = sizes[TORTUGA_MAGNITUDE_REGISTER]
+        point, save, restore = int(TortugaOpcode.POINT), int(TortugaOpcode.SAVE), int(TortugaOpcode.RESTORE)
+        registers = [0, 0, 0, 0, 0]
+        stack = []
+        for opcode in self.program.opcodes:
+            if opcode == point:
+                angle_idx, angle_sign, magnitude_idx, magnitude_sign, brush_idx = registers
+                signed_angle = angle_idx*2 + angle_sign
+                move = (signed_angle*count_magnitudes + magnitude_idx)*2 + magnitude_sign
+                x += dxs[move]
+                y += dys[move]
+                if normalize is not None:
+                    x, y = normalize(x), normalize(y)
+                yield (brushids[brush_idx], x, y, scales[magnitude_idx], brush_angles[signed_angle])
+            elif opcode == save:
+                stack.append((x, y, tuple(registers)))
+            elif opcode == restore:
+                x, y, saved = stack.pop()
+                registers[:] = saved
+            else:
+                register, step = steps[opcode]
+                registers[register] = (registers[register] + step) % sizes[register] if step != 0 else 0
+
+    def produce_records(self, fixed_point: bool = True)->List[Tuple]:
+        return list(self.iter_records(fixed_point))
+
+    def produce_arrays(self)->Tuple:
+        # positions (N, 2), scales, angles and brush indices as arrays
+        moves, brushes = self.program.walk_registers(self.sizes)
+        moves = asarray(moves, dtype=int64)
+        dxs, dys, x, y = self.float_moves
+        positions = walk_runs(asarray([dxs], dtype=float64)[:, moves], asarray([dys], dtype=float64)[:, moves], asarray([x], dtype=float64), asarray([y], dtype=float64), self.program.branch_runs())
+        count_magnitudes = self.sizes[TORTUGA_MAGNITUDE_REGISTER]
+        scales = asarray([float(scale) for scale in self.scales], dtype=float64)[(moves // 2) % count_magnitudes]
+        angles = asarray([float(angle) for angle in self.brush_angles], dtype=float64)[moves // (2*count_magnitudes)]
+        return (positions[0], scales, angles, asarray(brushes, dtype=int64))
+
+    def iter_produce(self, stats: V2dStats = None, abort = None):
+        self.aborted = False
+        if abort is not None and stats is None:
+            stats = TortugaStats()
+        denominator = self.denominator
+        for brushid, x, y, scale, angle in self.iter_records():
+            brushstroke = DlmtBrushstroke(brushid = brushid, xy = V2d(Fraction(x, denominator), Fraction(y, denominator)), scale = scale, angle = angle, tags = self.tags.copy())
+            if stats is not None:
+                stats.add(brushstroke.xy)
+            yield brushstroke
+            if abort is not None and abort(stats):
+                self.aborted = True
+                return
+
+    def produce(self, stats: V2dStats = None, abort = None)->List[DlmtBrushstroke]:
+        return list(self.iter_produce(stats, abort))
+
+# Evaluates one chain with many (angles, magnitudes, brush ids): the chain is
+# compiled once, and the variations with the same cycle sizes share the
+# register walk and are summed together
+class TortugaBatchProducer:
+    def __init__(self, config: TortugaConfig):
+        self.config = config
+        self.program = TortugaProgram.from_chain(config.chain)
+
+    def configure(self, angles: List[Fraction], magnitudes: List[Fraction], brushids: List[str])->TortugaConfig:
+        return self.config.clone().set_angles(angles).set_magnitudes(magnitudes).set_brush_ids(brushids)
+
+    def create_producer(self, angles: List[Fraction], magnitudes: List[Fraction], brushids: List[str])->TortugaCompiledProducer:
+        return TortugaCompiledProducer(self.configure(angles, magnitudes, brushids), self.program)
+
+    def produce_arrays(self, variations: List[Tuple[List[Fraction], List[Fraction], List[str]]])->List[Tuple]:
+        # the same (positions, scales, angles, brush indices) as TortugaCompiledProducer.produce_arrays, per variation
+        producers = [self.create_producer(angles, magnitudes, brushids) for angles, magnitudes, brushids in variations]
+        groups = {}
+        for n, producer in enumerate(producers):
+            groups.setdefault(tuple(producer.sizes), []).append(n)
+        results = [None] * len(producers)
+        for sizes, members in groups.items():
+            moves, brushes = self.program.walk_registers(sizes)
+            moves = asarray(moves, dtype=int64)
+            group = [producers[n] for n in members]
+            steps_x = asarray([producer.float_moves[0] for producer in group], dtype=float64)[:, moves]
+            steps_y = asarray([producer.float_moves[1] for producer in group], dtype=float64)[:, moves]
+            xs = asarray([producer.float_moves[2] for producer in group], dtype=float64)
+            ys = asarray([producer.float_moves[3] for producer in group], dtype=float64)
+            positions = walk_runs(steps_x, steps_y, xs, ys, self.program.branch_runs())
+            count_magnitudes = sizes[TORTUGA_MAGNITUDE_REGISTER]
+            scales = asarray([[float(scale) for scale in producer.scales] for producer in group], dtype=float64)[:, (moves // 2) % count_magnitudes]
+            angles = asarray([[float(angle) for angle in producer.brush_angles] for producer in group], dtype=float64)[:, moves // (2*count_magnitudes)]
+            brushes = asarray(brushes, dtype=int64)
+            for c, n in enumerate(members):
+                results[n] = (positions[c], scales[c], angles[c], brushes)
         return results
 
 class TortugaTargetRand: